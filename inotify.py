@@ -0,0 +1,81 @@
+import ctypes
+import ctypes.util
+import os
+import struct
+
+# Event masks from <sys/inotify.h>.
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+IN_CLOEXEC = os.O_CLOEXEC
+
+EVENT_HEADER = struct.Struct('iIII')
+
+_libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+
+
+def _check(ret):
+    if ret < 0:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+    return ret
+
+
+class Inotify:
+    """Minimal wrapper of the Linux inotify API, watching folders and
+    reporting their events as (path, mask) tuples.
+    """
+    def __init__(self):
+        self.fd = _check(_libc.inotify_init1(IN_CLOEXEC))
+        self.watches = {}
+
+    def fileno(self):
+        return self.fd
+
+    def add_watch(self, path, mask):
+        wd = _check(_libc.inotify_add_watch(self.fd, os.fsencode(path), mask))
+        self.watches[wd] = path
+        return wd
+
+    def remove_watch_tree(self, path):
+        """Stop watching the folder and all the folders below it.
+        """
+        for wd, watched in list(self.watches.items()):
+            if watched == path or watched.startswith(path + os.sep):
+                # The kernel may already have dropped it.
+                _libc.inotify_rm_watch(self.fd, wd)
+                del self.watches[wd]
+
+    def read_events(self):
+        """Read the pending events. Blocks until there is at least one.
+        """
+        data = os.read(self.fd, 64 * 1024)
+        pos = 0
+        while pos < len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, pos)
+            pos += EVENT_HEADER.size
+            name = os.fsdecode(data[pos:pos + length].rstrip(b'\0'))
+            pos += length
+
+            if mask & IN_Q_OVERFLOW:
+                yield None, mask
+                continue
+
+            folder = self.watches.get(wd)
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+            if folder is None:
+                continue
+            yield (os.path.join(folder, name) if name else folder), mask
+
+    def close(self):
+        os.close(self.fd)
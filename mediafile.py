@@ -46,21 +46,26 @@ import mutagen.monkeysaudio
 import mutagen.asf
 import mutagen.aiff
 import codecs
+import collections
 import datetime
 import re
 import base64
 import binascii
 import math
+import mmap
 import struct
 import imghdr
 import os
 import traceback
 import enum
+import errno
+import contextlib
 import logging
 import six
 
 
-__all__ = ['UnreadableFileError', 'FileTypeError', 'MediaFile']
+__all__ = ['UnreadableFileError', 'FileTypeError', 'MediaFile',
+           'has_supported_extension', 'is_supported', 'read_tags']
 
 log = logging.getLogger(__name__)
 
@@ -79,6 +84,36 @@ TYPES = {
     'aiff': 'AIFF',
 }
 
+# File name extensions used by each of the types.
+EXTENSIONS = {
+    'mp3':  ('mp3', 'mp2'),
+    'aac':  ('m4a', 'm4b', 'm4p', 'mp4'),
+    'alac': ('m4a',),
+    'ogg':  ('ogg', 'oga'),
+    'opus': ('opus', 'ogg'),
+    'flac': ('flac',),
+    'ape':  ('ape',),
+    'wv':   ('wv',),
+    'mpc':  ('mpc', 'mpp', 'mp+'),
+    'asf':  ('wma', 'asf'),
+    'aiff': ('aif', 'aiff', 'aifc'),
+}
+
+# Header bytes each type starts with, as (offset, bytes) pairs. MPEG
+# streams can start with junk, so MP3 files are not checked.
+MAGIC = {
+    'aac':  ((4, b'ftyp'),),
+    'alac': ((4, b'ftyp'),),
+    'ogg':  ((0, b'OggS'),),
+    'opus': ((0, b'OggS'),),
+    'flac': ((0, b'fLaC'),),
+    'ape':  ((0, b'MAC '),),
+    'wv':   ((0, b'wvpk'),),
+    'mpc':  ((0, b'MP+'), (0, b'MPCK')),
+    'asf':  ((0, b'\x30\x26\xb2\x75\x8e\x66\xcf\x11'),),
+    'aiff': ((0, b'FORM'),),
+}
+
 PREFERRED_IMAGE_EXTENSIONS = {'jpeg': 'jpg'}
 
 
@@ -140,6 +175,48 @@ def mutagen_call(action, path, func, *args, **kwargs):
         raise MutagenError(path, exc)
 
 
+def _extension_types(path):
+    ext = os.path.splitext(os.fsdecode(path))[1][1:].lower()
+    return [type for type in EXTENSIONS if ext in EXTENSIONS[type]]
+
+
+def has_supported_extension(path):
+    """Check whether the file name has the extension of one of the
+    supported `TYPES`. The file itself is not touched.
+    """
+    return bool(_extension_types(path))
+
+
+def is_supported(path):
+    """Guess from the extension and the first bytes of the file whether
+    it is one of the supported `TYPES`, without handing it to Mutagen.
+
+    Files that pass may still be rejected by `MediaFile`, but most other
+    files (images, playlists, cue sheets...) are rejected cheaply.
+    """
+    types = _extension_types(path)
+    if not types:
+        return False
+
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(16)
+    except (IOError, OSError):
+        return False
+
+    # An ID3 tag may be prepended to several formats.
+    if header.startswith(b'ID3'):
+        return True
+
+    for type in types:
+        if type not in MAGIC:
+            return True
+        for offset, magic in MAGIC[type]:
+            if header[offset:offset + len(magic)] == magic:
+                return True
+    return False
+
+
 # Utility.
 
 def _safe_cast(out_type, val):
@@ -1144,16 +1221,25 @@ class MediaField(object):
         """
         self.out_type = kwargs.get('out_type', six.text_type)
         self._styles = styles
+        self._format_styles = {}
 
     def styles(self, mutagen_file):
-        """Yields the list of storage styles of this field that can
-        handle the MediaFile's format.
+        """Get the storage styles of this field that can handle the
+        MediaFile's format. They are looked up once per format.
         """
-        for style in self._styles:
-            if mutagen_file.__class__.__name__ in style.formats:
-                yield style
+        name = mutagen_file.__class__.__name__
+        try:
+            return self._format_styles[name]
+        except KeyError:
+            styles = tuple(style for style in self._styles
+                           if name in style.formats)
+            self._format_styles[name] = styles
+            return styles
 
     def __get__(self, mediafile, owner=None):
+        return mediafile._cached(self, self._get)
+
+    def _get(self, mediafile):
         out = None
         for style in self.styles(mediafile.mgfile):
             out = style.get(mediafile.mgfile)
@@ -1192,7 +1278,7 @@ class ListMediaField(MediaField):
     Uses ``get_list`` and set_list`` methods of its ``StorageStyle``
     strategies to do the actual work.
     """
-    def __get__(self, mediafile, _):
+    def _get(self, mediafile):
         values = []
         for style in self.styles(mediafile.mgfile):
             values.extend(style.get_list(mediafile.mgfile))
@@ -1210,6 +1296,37 @@ class ListMediaField(MediaField):
         return MediaField(*self._styles, **options)
 
 
+def _split_date(datestring, get_year=None):
+    """Get the year, month and day of a date tag, each an integer or
+    None. `get_year` is called for the year when the date has none.
+    """
+    # Split on hyphens and slashes.
+    if isinstance(datestring, six.string_types):
+        datestring = re.sub(r'[Tt ].*$', '', six.text_type(datestring))
+        items = re.split('[-/]', six.text_type(datestring))
+    else:
+        items = []
+
+    # Ensure that we have exactly 3 components, possibly by
+    # truncating or padding.
+    items = items[:3]
+    if len(items) < 3:
+        items += [None] * (3 - len(items))
+
+    # Use year field if year is missing.
+    if not items[0] and get_year is not None:
+        items[0] = get_year()
+
+    # Convert each component to an integer if possible.
+    items_ = []
+    for item in items:
+        try:
+            items_.append(int(item))
+        except:
+            items_.append(None)
+    return tuple(items_)
+
+
 class DateField(MediaField):
     """Descriptor that handles serializing and deserializing dates
 
@@ -1231,7 +1348,7 @@ class DateField(MediaField):
         if year_style:
             self._year_field = MediaField(*year_style)
 
-    def __get__(self, mediafile, owner=None):
+    def _get(self, mediafile):
         year, month, day = self._get_date_tuple(mediafile)
         if not year:
             return None
@@ -1260,32 +1377,14 @@ class DateField(MediaField):
         year, month, and day number. Each number is either an integer or
         None.
         """
-        # Get the underlying data and split on hyphens and slashes.
-        datestring = super(DateField, self).__get__(mediafile, None)
-        if isinstance(datestring, six.string_types):
-            datestring = re.sub(r'[Tt ].*$', '', six.text_type(datestring))
-            items = re.split('[-/]', six.text_type(datestring))
-        else:
-            items = []
-
-        # Ensure that we have exactly 3 components, possibly by
-        # truncating or padding.
-        items = items[:3]
-        if len(items) < 3:
-            items += [None] * (3 - len(items))
-
-        # Use year field if year is missing.
-        if not items[0] and hasattr(self, '_year_field'):
-            items[0] = self._year_field.__get__(mediafile)
+        return list(mediafile._cached((self, 'date'), self._parse_date))
 
-        # Convert each component to an integer if possible.
-        items_ = []
-        for item in items:
-            try:
-                items_.append(int(item))
-            except:
-                items_.append(None)
-        return items_
+    def _parse_date(self, mediafile):
+        get_year = None
+        if hasattr(self, '_year_field'):
+            def get_year():
+                return self._year_field.__get__(mediafile)
+        return _split_date(MediaField._get(self, mediafile), get_year)
 
     def _set_date_tuple(self, mediafile, year, month=None, day=None):
         """Set the value of the field given a year, month, and day
@@ -1325,7 +1424,7 @@ class DateItemField(MediaField):
         self.date_field = date_field
         self.item_pos = item_pos
 
-    def __get__(self, mediafile, _):
+    def _get(self, mediafile):
         return self.date_field._get_date_tuple(mediafile)[self.item_pos]
 
     def __set__(self, mediafile, value):
@@ -1348,7 +1447,7 @@ class CoverArtField(MediaField):
     def __init__(self):
         pass
 
-    def __get__(self, mediafile, _):
+    def _get(self, mediafile):
         candidates = mediafile.images
         if candidates:
             return self.guess_cover_image(candidates).data
@@ -1395,6 +1494,598 @@ class ImageListField(ListMediaField):
             out_type=Image,
         )
 
+    def _get(self, mediafile):
+        # The pictures may have been left on disk (see `skip_art`).
+        mediafile._load_art()
+        return super(ImageListField, self)._get(mediafile)
+
+
+# Reading tags without the embedded pictures.
+
+ID3_FRAME_ID = re.compile(b'^[A-Z0-9]{4}$')
+
+
+def _syncsafe(data):
+    size = 0
+    for byte in bytearray(data):
+        size = (size << 7) | (byte & 0x7f)
+    return size
+
+
+def _strip_id3_art(f):
+    """Rebuild the ID3v2 tag at the start of `f` without its APIC
+    frames, which are skipped rather than read. Returns the new tag and
+    the offset at which the original one ended, or None if there was
+    nothing to skip or the tag is one this doesn't handle.
+    """
+    header = bytearray(f.read(10))
+    if len(header) < 10:
+        return None
+    major, flags = header[3], header[5]
+    # Unsynchronised tags, extended headers and footers are left to
+    # Mutagen, as are ID3v2.2 tags.
+    if major not in (3, 4) or flags & 0xd0:
+        return None
+    end = 10 + _syncsafe(header[6:10])
+
+    frames = []
+    skipped = False
+    pos = 10
+    while pos + 10 <= end:
+        f.seek(pos)
+        frame = f.read(10)
+        if len(frame) < 10 or frame[:1] == b'\0':
+            # Padding.
+            break
+        if not ID3_FRAME_ID.match(frame[:4]):
+            return None
+        if major == 4:
+            size = _syncsafe(frame[4:8])
+        else:
+            size = struct.unpack('>I', frame[4:8])[0]
+        if pos + 10 + size > end:
+            return None
+
+        if frame[:4] == b'APIC':
+            skipped = True
+        else:
+            frames.append(frame + f.read(size))
+        pos += 10 + size
+
+    if not skipped:
+        return None
+    data = b''.join(frames)
+    size = len(data)
+    header[6:10] = bytearray((size >> shift) & 0x7f for shift in (21, 14, 7, 0))
+    return bytes(header) + data, end
+
+
+def _strip_flac_art(f):
+    """Rebuild the metadata blocks of the FLAC file `f` without its
+    PICTURE blocks, which are skipped rather than read. Returns the new
+    header and the offset of the audio frames, or None if there was
+    nothing to skip.
+    """
+    blocks = []
+    skipped = False
+    pos = 4
+    while True:
+        f.seek(pos)
+        header = bytearray(f.read(4))
+        if len(header) < 4:
+            return None
+        size = struct.unpack('>I', b'\0' + bytes(header[1:]))[0]
+        if (header[0] & 0x7f) == 6:
+            skipped = True
+        else:
+            blocks.append(header + f.read(size))
+        pos += 4 + size
+        if header[0] & 0x80:
+            break
+
+    if not skipped:
+        return None
+    for block in blocks:
+        block[0] &= 0x7f
+    blocks[-1][0] |= 0x80
+    return b'fLaC' + b''.join(bytes(block) for block in blocks), pos
+
+
+def _strip_art(f):
+    magic = f.read(4)
+    f.seek(0)
+    if magic.startswith(b'ID3'):
+        return _strip_id3_art(f)
+    elif magic == b'fLaC':
+        return _strip_flac_art(f)
+    return None
+
+
+class SplicedFile(object):
+    """A read-only file object made of the bytes `head` followed by the
+    content of `fileobj` from `offset` on, letting Mutagen parse a file
+    whose header was rewritten in memory.
+    """
+    def __init__(self, head, fileobj, offset, name):
+        self.head = head
+        self.fileobj = fileobj
+        self.offset = offset
+        self.name = name
+        self.pos = 0
+        fileobj.seek(0, os.SEEK_END)
+        self.size = len(head) + fileobj.tell() - offset
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, pos, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            pos += self.pos
+        elif whence == os.SEEK_END:
+            pos += self.size
+        if pos < 0:
+            raise IOError(errno.EINVAL, os.strerror(errno.EINVAL))
+        self.pos = pos
+        return pos
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = max(0, self.size - self.pos)
+        data = self.head[self.pos:self.pos + size]
+        if len(data) < size:
+            start = self.pos + len(data) - len(self.head)
+            self.fileobj.seek(self.offset + start)
+            data += self.fileobj.read(size - len(data))
+        self.pos += len(data)
+        return data
+
+
+class MappedFile(mmap.mmap):
+    """A read-only memory map of a file, which Mutagen reads as a file
+    object: probing the formats and walking the frames and blocks are
+    memory reads instead of a seek and a read call each.
+    """
+    name = None
+
+
+def _is_fileobj(path):
+    return hasattr(path, 'read')
+
+
+def _map_file(path):
+    """Map the file at `path` as a `MappedFile`. Returns None when it
+    can't be mapped (empty files, pipes, a file system without mmap, a
+    lack of address space...) and must be read normally.
+    """
+    try:
+        with open(path, 'rb') as f:
+            mapped = MappedFile(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (EnvironmentError, ValueError, OverflowError):
+        return None
+    mapped.name = os.fsdecode(path)
+    return mapped
+
+
+# Reading the common fields straight from the tags, without Mutagen's
+# objects or the storage styles.
+
+# Fields `read_tags` can read this way.
+FAST_FIELDS = frozenset([
+    'title', 'artist', 'album', 'genre', 'comments', 'track', 'year',
+    'length', 'samplerate', 'bitdepth', 'channels', 'bitrate',
+    'bitrate_mode', 'format',
+])
+
+ID3_CODECS = {
+    0: ('latin1', b'\x00'),
+    1: ('utf-16', b'\x00\x00'),
+    2: ('utf-16-be', b'\x00\x00'),
+    3: ('utf-8', b'\x00'),
+}
+
+# The frames the fields come from, and the dates of ID3v2.3.
+ID3_FAST_FRAMES = frozenset([b'TIT2', b'TPE1', b'TALB', b'TCON', b'COMM',
+                             b'TRCK', b'TDRC', b'TYER', b'TDAT', b'TIME'])
+
+# Frames an ID3v1 tag at the end of the file would add when missing.
+ID3V1_FRAMES = ('TIT2', 'TPE1', 'TALB', 'TCON', 'TRCK', 'TDRC')
+
+# Vorbis comments of the fields, in the order `MediaFile` looks them up.
+VORBIS_FAST_KEYS = {
+    'title': (b'title',),
+    'artist': (b'artist',),
+    'album': (b'album',),
+    'genre': (b'genre',),
+    'comments': (b'description', b'comment'),
+    'track': (b'track', b'tracknumber'),
+    'date': (b'date',),
+    'year': (b'year',),
+}
+
+# Signs in the first bytes of an Ogg file that Mutagen could take it for
+# something else than Ogg Vorbis.
+OGG_OTHER_MAGIC = (b'FLAC', b'fLaC', b'theora', b'Speex   ', b'OpusHead',
+                   b'ftyp', b'mp4', b'ADIF')
+
+
+class FastReadError(Exception):
+    """A file the fast path leaves to Mutagen.
+    """
+
+
+def _first_value(values):
+    # The first value that is set, as `MediaField` looks up its styles.
+    out = None
+    for out in values:
+        if out:
+            break
+    return out
+
+
+def _read_exactly(f, size):
+    data = f.read(size)
+    if len(data) < size:
+        raise FastReadError('truncated file')
+    return data
+
+
+def _id3_string(data, encoding, v23):
+    """Decode the first null-terminated string of an ID3 frame as
+    Mutagen does, and return it with the data left.
+    """
+    codec, term = ID3_CODECS[encoding]
+    index = data.find(term)
+    while index != -1 and index % len(term):
+        index = data.find(term, index + 1)
+    if index == -1:
+        value, data = data.decode(codec), b''
+    else:
+        value, data = data[:index].decode(codec), data[index + len(term):]
+    # Zero padding in ID3v2.3 isn't a list of empty strings.
+    if v23 and not data.strip(b'\x00'):
+        data = b''
+    return value, data
+
+
+def _id3_strings(data, encoding, v23):
+    values = []
+    while data:
+        value, data = _id3_string(data, encoding, v23)
+        values.append(value)
+    return values
+
+
+def _fast_id3(f):
+    """Read the text of the frames of the fields in the ID3v2.3 or 2.4
+    tag at the start of `f`, seeking over the others. Returns the texts
+    by frame id, the COMM frames as (description, texts) pairs, and the
+    size of the tag.
+    """
+    f.seek(0)
+    header = bytearray(_read_exactly(f, 10))
+    if header[3] not in (3, 4) or header[5] or \
+       any(byte & 0x80 for byte in header[6:10]):
+        raise FastReadError('unsupported ID3 tag')
+    v23 = header[3] == 3
+    end = 10 + _syncsafe(header[6:10])
+
+    frames = {}
+    comments = []
+    keys = set()
+    pos = 10
+    while pos + 10 <= end:
+        f.seek(pos)
+        frame = _read_exactly(f, 10)
+        name = frame[:4]
+        if name == b'\x00\x00\x00\x00':
+            # Padding.
+            break
+        if not ID3_FRAME_ID.match(name):
+            raise FastReadError('unknown frame')
+        if v23:
+            size = struct.unpack('>I', frame[4:8])[0]
+        elif any(byte & 0x80 for byte in bytearray(frame[4:8])):
+            # Not syncsafe, as some old iTunes wrote.
+            raise FastReadError('frame size not syncsafe')
+        else:
+            size = _syncsafe(frame[4:8])
+        pos += 10 + size
+        if pos > end:
+            raise FastReadError('frame past the end of the tag')
+        if size == 0 or name not in ID3_FAST_FRAMES:
+            continue
+
+        # Compressed, encrypted, grouped or unsynchronised frames.
+        flags = struct.unpack('>H', frame[8:10])[0]
+        if flags & (0x00e0 if v23 else 0x004f):
+            raise FastReadError('frame flags')
+
+        data = _read_exactly(f, size)
+        encoding = bytearray(data[:1])[0]
+        if encoding not in ID3_CODECS:
+            raise FastReadError('text encoding')
+
+        if name == b'COMM':
+            lang = data[1:4].decode('ascii')
+            desc, text = _id3_string(data[4:], encoding, v23)
+            key = (desc, lang)
+            comments.append((desc, _id3_strings(text, encoding, v23)))
+        else:
+            key = name
+            frames[name.decode('ascii')] = _id3_strings(data[1:], encoding,
+                                                        v23)
+
+        # Frames Mutagen would merge.
+        if key in keys:
+            raise FastReadError('duplicate frame')
+        keys.add(key)
+    return frames, comments, end
+
+
+def _fast_mp3(f):
+    frames, comments, offset = _fast_id3(f)
+
+    # An ID3v1 tag fills in the missing frames.
+    f.seek(0, os.SEEK_END)
+    f.seek(max(0, f.tell() - 131))
+    if b'TAG' in f.read() and not all(name in frames
+                                      for name in ID3V1_FRAMES):
+        raise FastReadError('ID3v1 tag')
+
+    # ID3v2.3 dates, converted to a TDRC frame.
+    timestamps = []
+    old_frames = [frames.pop(name, []) for name in ('TYER', 'TDAT', 'TIME')]
+    for tyer, tdat, time in six.moves.zip_longest(*old_frames, fillvalue=''):
+        ym = re.match(r'([0-9]{4})(-[0-9]{2}-[0-9]{2})?\Z', tyer)
+        dm = re.match(r'([0-9]{2})([0-9]{2})\Z', tdat)
+        tm = re.match(r'([0-9]{2})([0-9]{2})\Z', time)
+        timestamp = ''
+        if ym:
+            year, month_day = ym.groups()
+            timestamp += year
+            if dm:
+                month_day = '-%s-%s' % dm.groups()[::-1]
+            if month_day:
+                timestamp += month_day
+                if tm:
+                    timestamp += 'T%s:%s:00' % tm.groups()
+        if timestamp:
+            timestamps.append(timestamp)
+    if timestamps and 'TDRC' not in frames:
+        frames['TDRC'] = timestamps
+
+    def text(name):
+        values = frames.get(name)
+        return values[0] if values else None
+
+    track = text('TRCK')
+    genres = mutagen.id3.TCON(encoding=3, text=frames.get('TCON', [])).genres
+    date = text('TDRC')
+    raw = {
+        'title': text('TIT2'),
+        'artist': text('TPE1'),
+        'album': text('TALB'),
+        'genre': genres[0] if genres else None,
+        'comments': None,
+        'track': track.split('/')[0] if track else None,
+        'date': None if date is None else mutagen.id3.ID3TimeStamp(date),
+        'year': None,
+    }
+    for desc, values in comments:
+        if desc.lower() == u'':
+            raw['comments'] = values[0] if values else None
+            break
+
+    info = mutagen.mp3.MPEGInfo(f, offset)
+    return raw, info
+
+
+def _vorbis_comments(data, framing=True):
+    """Parse a Vorbis comment block as Mutagen does, keeping the values
+    of the keys in `VORBIS_FAST_KEYS`. Returns them by lowercase key, and
+    the size of the block.
+    """
+    keys = set(key for names in VORBIS_FAST_KEYS.values() for key in names)
+    comments = {}
+    pos = 4 + struct.unpack_from('<I', data)[0]
+    count = struct.unpack_from('<I', data, pos)[0]
+    pos += 4
+    for i in range(count):
+        length = struct.unpack_from('<I', data, pos)[0]
+        comment = data[pos + 4:pos + 4 + length]
+        pos += 4 + length
+        if pos > len(data):
+            raise FastReadError('truncated comment')
+        index = comment.find(b'=')
+        key = comment[:index].lower()
+        if index != -1 and key in keys:
+            value = comment[index + 1:].decode('utf-8', 'replace')
+            comments.setdefault(key, []).append(value)
+
+    if framing:
+        if not bytearray(data[pos:pos + 1] or b'\x00')[0] & 0x01:
+            raise FastReadError('framing bit unset')
+        pos += 1
+    return comments, pos
+
+
+def _vorbis_raw(comments):
+    def values(field):
+        return [comments[key][0] if key in comments else None
+                for key in VORBIS_FAST_KEYS[field]]
+    return dict((field, _first_value(values(field)))
+                for field in VORBIS_FAST_KEYS)
+
+
+class FastInfo(object):
+    """The audio properties of a file read by the fast path, named as
+    in Mutagen's stream information.
+    """
+    bits_per_sample = 0
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+def _fast_flac(f):
+    f.seek(4)
+    info = None
+    comments = None
+    seektables = 0
+    pos = 4
+    while True:
+        header = bytearray(_read_exactly(f, 4))
+        code = header[0] & 0x7f
+        size = struct.unpack('>I', b'\x00' + bytes(header[1:]))[0]
+        if info is None:
+            if code != 0 or size != 34:
+                raise FastReadError('no STREAMINFO block')
+            bits = struct.unpack('>Q', _read_exactly(f, 34)[10:18])[0]
+            sample_rate = bits >> 44
+            if not sample_rate:
+                raise FastReadError('no sample rate')
+            info = FastInfo(
+                sample_rate=sample_rate,
+                channels=((bits >> 41) & 7) + 1,
+                bits_per_sample=((bits >> 36) & 0x1f) + 1,
+                length=(bits & 0xfffffffff) / float(sample_rate),
+            )
+        elif code == 0 or code == 5:
+            raise FastReadError('second STREAMINFO or CUESHEET block')
+        elif code == 3:
+            seektables += 1
+            if seektables > 1:
+                raise FastReadError('second SEEKTABLE block')
+        elif code == 4:
+            # Mutagen parses the comments, not trusting the size.
+            block, read = _vorbis_comments(_read_exactly(f, size), False)
+            if read != size:
+                raise FastReadError('VORBIS_COMMENT size')
+            if comments is None:
+                comments = block
+        elif code == 6:
+            # Same for the pictures, whose data is skipped.
+            mime = struct.unpack('>I', _read_exactly(f, 8)[4:])[0]
+            f.seek(mime, os.SEEK_CUR)
+            desc = struct.unpack('>I', _read_exactly(f, 4))[0]
+            f.seek(desc, os.SEEK_CUR)
+            data = struct.unpack('>I', _read_exactly(f, 20)[16:])[0]
+            if 32 + mime + desc + data != size:
+                raise FastReadError('PICTURE size')
+        pos += 4 + size
+        f.seek(pos)
+        if header[0] & 0x80:
+            break
+
+    f.seek(0, os.SEEK_END)
+    end = f.tell()
+    if pos > end:
+        raise FastReadError('truncated metadata')
+    info.bitrate = 0
+    if info.length:
+        info.bitrate = int(float(end - pos) * 8 / info.length)
+    return _vorbis_raw(comments or {}), info
+
+
+def _fast_ogg(f):
+    f.seek(0)
+    page = mutagen.ogg.OggPage(f)
+    if not page.packets or not page.first or \
+       not page.packets[0].startswith(b'\x01vorbis') or \
+       len(page.packets[0]) < 28:
+        raise FastReadError('no Vorbis header')
+    channels, sample_rate, max_bitrate, nominal_bitrate, min_bitrate = \
+        struct.unpack('<BI3i', page.packets[0][11:28])
+    if not sample_rate:
+        raise FastReadError('no sample rate')
+    serial = page.serial
+
+    max_bitrate = max(0, max_bitrate)
+    min_bitrate = max(0, min_bitrate)
+    nominal_bitrate = max(0, nominal_bitrate)
+    if nominal_bitrate == 0:
+        bitrate = (max_bitrate + min_bitrate) // 2
+    elif max_bitrate and max_bitrate < nominal_bitrate:
+        bitrate = max_bitrate
+    elif min_bitrate > nominal_bitrate:
+        bitrate = min_bitrate
+    else:
+        bitrate = nominal_bitrate
+
+    pages = []
+    complete = False
+    while not complete:
+        page = mutagen.ogg.OggPage(f)
+        if page.serial == serial:
+            pages.append(page)
+            complete = page.complete or len(page.packets) > 1
+    data = mutagen.ogg.OggPage.to_packets(pages)[0][7:]
+    comments, read = _vorbis_comments(data)
+
+    page = mutagen.ogg.OggPage.find_last(f, serial, finishing=True)
+    if page is None:
+        raise FastReadError('no last page')
+    info = FastInfo(sample_rate=sample_rate, channels=channels,
+                    bitrate=bitrate, length=page.position / float(sample_rate))
+    return _vorbis_raw(comments), info
+
+
+def _read_fast(path, fields):
+    """Read `fields`, all in `FAST_FIELDS`, of an MP3, FLAC or Ogg Vorbis
+    file directly from its tags, with the values `MediaFile` would give.
+    Returns None for the files it doesn't handle.
+    """
+    ext = os.path.splitext(os.fsdecode(path))[1].lower()
+    with open(path, 'rb') as f:
+        header = f.read(128)
+        if header.startswith(b'ID3') and ext == '.mp3':
+            type = 'mp3'
+            raw, info = _fast_mp3(f)
+        elif header.startswith(b'fLaC') and ext == '.flac':
+            type = 'flac'
+            raw, info = _fast_flac(f)
+        elif header.startswith(b'OggS') and b'\x01vorbis' in header and \
+                ext in ('.ogg', '.oga') and \
+                not any(magic in header for magic in OGG_OTHER_MAGIC):
+            type = 'ogg'
+            raw, info = _fast_ogg(f)
+        else:
+            return None
+
+        values = []
+        for field in fields:
+            if field == 'year':
+                value = _split_date(
+                    _safe_cast(six.text_type, raw['date']),
+                    lambda: _safe_cast(six.text_type, raw['year']))[0]
+            elif field == 'track':
+                value = _safe_cast(int, raw['track'])
+            elif field in raw:
+                value = _safe_cast(six.text_type, raw[field])
+            elif field == 'length':
+                value = info.length
+            elif field == 'samplerate':
+                value = info.sample_rate
+            elif field == 'bitdepth':
+                value = getattr(info, 'bits_per_sample', 0)
+            elif field == 'channels':
+                value = info.channels
+            elif field == 'bitrate':
+                value = info.bitrate
+                if not value and info.length:
+                    f.seek(0, os.SEEK_END)
+                    value = int(f.tell() * 8 / info.length)
+            elif field == 'bitrate_mode':
+                value = {
+                    mutagen.mp3.BitrateMode.CBR: 'CBR',
+                    mutagen.mp3.BitrateMode.VBR: 'VBR',
+                    mutagen.mp3.BitrateMode.ABR: 'ABR',
+                }.get(getattr(info, 'bitrate_mode', None), '')
+            elif field == 'format':
+                value = TYPES[type]
+            values.append(value)
+    return values
+
 
 # MediaFile is a collection of fields.
 
@@ -1402,16 +2093,41 @@ class MediaFile(object):
     """Represents a multimedia file on disk and provides access to its
     metadata.
     """
-    def __init__(self, path, id3v23=False):
+    def __init__(self, path, id3v23=False, cache=False, skip_art=False,
+                 use_mmap=False):
         """Constructs a new `MediaFile` reflecting the file at path. May
         throw `UnreadableFileError`.
 
+        `path` may also be a file object, such as an `io.BytesIO` of the
+        content of a file or an `mmap`. Its `name`, if any, helps to
+        guess the type of the file, and `save` writes to it.
+
         By default, MP3 files are saved with ID3v2.4 tags. You can use
         the older ID3v2.3 standard by specifying the `id3v23` option.
+
+        With `cache`, each field is decoded once and its value kept
+        until a field is set or deleted. The values returned are shared,
+        so they must not be modified.
+
+        With `skip_art`, the pictures embedded in MP3 (ID3v2.3 and 2.4)
+        and FLAC files are skipped on disk instead of being read and
+        parsed. They are read when `images` or `art` is first accessed,
+        or before any field is modified.
+
+        With `use_mmap`, a file given by its path is parsed from a
+        read-only memory map of it, unmapped once it is read. Beware
+        that a file truncated meanwhile kills the process with SIGBUS.
         """
+        self._field_cache = {} if cache else None
+        self._art_skipped = False
+        self._use_mmap = use_mmap
         self.path = path
 
-        self.mgfile = mutagen_call('open', path, mutagen.File, path)
+        self.mgfile = None
+        if skip_art:
+            self.mgfile = self._open_without_art()
+        if self.mgfile is None:
+            self.mgfile = self._open()
 
         if self.mgfile is None:
             # Mutagen couldn't guess the type
@@ -1452,10 +2168,75 @@ class MediaFile(object):
         # Set the ID3v2.3 flag only for MP3s.
         self.id3v23 = id3v23 and self.type == 'mp3'
 
+    def _reader(self):
+        """The file to read, as a file object: the one given, a memory
+        map of the file with `use_mmap`, or else the file opened.
+        """
+        if _is_fileobj(self.path):
+            return contextlib.nullcontext(self.path)
+        mapped = None
+        if self._use_mmap:
+            mapped = _map_file(self.path)
+        if mapped is None:
+            return open(self.path, 'rb')
+        return mapped
+
+    def _open(self):
+        """Open the file with Mutagen, from a memory map of it with
+        `use_mmap`.
+        """
+        if _is_fileobj(self.path) or not self._use_mmap:
+            return mutagen_call('open', self.path, mutagen.File, self.path)
+        mapped = _map_file(self.path)
+        if mapped is None:
+            # Mutagen reports the errors, if any.
+            return mutagen_call('open', self.path, mutagen.File, self.path)
+        with mapped:
+            return mutagen_call('open', self.path, mutagen.File, mapped)
+
+    def _open_without_art(self):
+        """Open the file with Mutagen as if it had no embedded pictures.
+        Returns None when it has none, or when it can't be read this way
+        and must be opened normally.
+        """
+        try:
+            with self._reader() as f:
+                stripped = _strip_art(f)
+                if stripped is None:
+                    return None
+                head, offset = stripped
+                name = getattr(f, 'name', None)
+                if isinstance(name, bytes):
+                    name = os.fsdecode(name)
+                mgfile = mutagen.File(SplicedFile(head, f, offset, name))
+        except Exception as exc:
+            # The normal read reports the errors, if any.
+            log.debug(u'could not skip the art of %r: %s',
+                      self.path, six.text_type(exc))
+            return None
+
+        if mgfile is not None:
+            self._art_skipped = True
+        return mgfile
+
+    def _load_art(self):
+        """Open the file again with its embedded pictures, if they were
+        skipped.
+        """
+        if not self.__dict__.get('_art_skipped'):
+            return
+        self._art_skipped = False
+        self.mgfile = self._open()
+        if self.mgfile.tags is None:
+            self.mgfile.add_tags()
+        self._clear_cache()
+
     def save(self):
         """Write the object's tags back to the file. May
         throw `UnreadableFileError`.
         """
+        self._load_art()
+
         # Possibly save the tags to ID3v2.3.
         kwargs = {}
         if self.id3v23:
@@ -1466,13 +2247,63 @@ class MediaFile(object):
             id3.update_to_v23()
             kwargs['v2_version'] = 3
 
-        mutagen_call('save', self.path, self.mgfile.save, **kwargs)
+        # The file may have been read from a copy or a memory map. Mutagen
+        # expects a file object at its start, so rewind it.
+        if _is_fileobj(self.path):
+            self.path.seek(0)
+        mutagen_call('save', self.path, self.mgfile.save, self.path,
+                     **kwargs)
 
     def delete(self):
         """Remove the current metadata tag from the file. May
         throw `UnreadableFileError`.
         """
-        mutagen_call('delete', self.path, self.mgfile.delete)
+        self._load_art()
+        if _is_fileobj(self.path):
+            self.path.seek(0)
+        mutagen_call('delete', self.path, self.mgfile.delete, self.path)
+        self._clear_cache()
+
+    # Decoded field values, with the `cache` option.
+
+    def _cached(self, key, get):
+        """Get the value of a field from the cache, or decode it with
+        `get` and keep it there.
+        """
+        cache = self._field_cache
+        if cache is None:
+            return get(self)
+        try:
+            return cache[key]
+        except KeyError:
+            value = cache[key] = get(self)
+            return value
+
+    def _clear_cache(self):
+        cache = self.__dict__.get('_field_cache')
+        if cache:
+            cache.clear()
+
+    def _before_write(self, name):
+        # Fields are written to the complete tags, pictures included.
+        for cls in type(self).__mro__:
+            if isinstance(cls.__dict__.get(name), MediaField):
+                self._load_art()
+                break
+        self._clear_cache()
+
+    def __setattr__(self, name, value):
+        # Setting a field may change others (the date and its year), and
+        # the descriptors read fields while they set them, so the cache
+        # is dropped before and after.
+        self._before_write(name)
+        object.__setattr__(self, name, value)
+        self._clear_cache()
+
+    def __delattr__(self, name):
+        self._before_write(name)
+        object.__delattr__(self, name)
+        self._clear_cache()
 
     # Convenient access to the set of available fields.
 
@@ -1482,14 +2313,21 @@ class MediaFile(object):
         metadata tags (i.e., those that are instances of
         :class:`MediaField`).
         """
-        for property, descriptor in cls.__dict__.items():
-            if isinstance(descriptor, MediaField):
-                if isinstance(property, bytes):
-                    # On Python 2, class field names are bytes. This method
-                    # produces text strings.
-                    yield property.decode('utf8', 'ignore')
-                else:
-                    yield property
+        names = cls.__dict__.get('_field_names')
+        if names is None:
+            names = []
+            for property, descriptor in cls.__dict__.items():
+                if isinstance(descriptor, MediaField):
+                    if isinstance(property, bytes):
+                        # On Python 2, class field names are bytes. This
+                        # method produces text strings.
+                        names.append(property.decode('utf8', 'ignore'))
+                    else:
+                        names.append(property)
+            # Kept in this very class, the fields of a subclass differ.
+            names = tuple(names)
+            cls._field_names = names
+        return iter(names)
 
     @classmethod
     def _field_sort_name(cls, name):
@@ -1516,8 +2354,11 @@ class MediaFile(object):
         :class:`DateItemField`, which are sorted in year-month-day
         order.
         """
-        for property in sorted(cls.fields(), key=cls._field_sort_name):
-            yield property
+        names = cls.__dict__.get('_sorted_field_names')
+        if names is None:
+            names = tuple(sorted(cls.fields(), key=cls._field_sort_name))
+            cls._sorted_field_names = names
+        return iter(names)
 
     @classmethod
     def readable_fields(cls):
@@ -1527,7 +2368,7 @@ class MediaFile(object):
         for property in cls.fields():
             yield property
         for property in ('length', 'samplerate', 'bitdepth', 'bitrate',
-                         'channels', 'format'):
+                         'bitrate_mode', 'channels', 'format'):
             yield property
 
     @classmethod
@@ -1546,6 +2387,8 @@ class MediaFile(object):
             raise ValueError(
                 u'property "{0}" already exists on MediaField'.format(name))
         setattr(cls, name, descriptor)
+        cls._field_names = None
+        cls._sorted_field_names = None
 
     def update(self, dict):
         """Set all field values from a dictionary.
@@ -1562,6 +2405,20 @@ class MediaFile(object):
                 else:
                     setattr(self, field, dict[field])
 
+    def snapshot(self, fields=None):
+        """Get the values of `fields`, by default all the readable
+        ones, as a compact read-only record with an attribute per field.
+
+        The mutagen file, with all its frames and pictures, is released
+        afterwards, so the `MediaFile` can't be used any more.
+        """
+        if fields is None:
+            fields = tuple(self.readable_fields())
+        record = _snapshot_type(tuple(fields))
+        values = record._make(getattr(self, field) for field in record._fields)
+        self.mgfile = None
+        return values
+
     # Field definitions.
 
     title = MediaField(
@@ -2007,10 +2864,67 @@ class MediaFile(object):
             if not self.length:
                 # Avoid division by zero if length is not available.
                 return 0
-            size = os.path.getsize(self.path)
+            if _is_fileobj(self.path):
+                # Leave the caller's file where it was.
+                pos = self.path.tell()
+                size = self.path.seek(0, os.SEEK_END)
+                self.path.seek(pos)
+            else:
+                size = os.path.getsize(self.path)
             return int(size * 8 / self.length)
 
+    @property
+    def bitrate_mode(self):
+        """The mode of the bitrate used in the audio coding (a string,
+        eg. "CBR", "VBR" or "ABR"). Only available for the MP3 file
+        format (empty where unavailable).
+        """
+        if hasattr(self.mgfile.info, 'bitrate_mode'):
+            return {
+                mutagen.mp3.BitrateMode.CBR: 'CBR',
+                mutagen.mp3.BitrateMode.VBR: 'VBR',
+                mutagen.mp3.BitrateMode.ABR: 'ABR',
+            }.get(self.mgfile.info.bitrate_mode, '')
+        return ''
+
     @property
     def format(self):
         """A string describing the file format/codec."""
         return TYPES[self.type]
+
+
+# Records returned by `MediaFile.snapshot`, a class per list of fields.
+
+_snapshot_types = {}
+
+
+def _snapshot_type(fields):
+    try:
+        return _snapshot_types[fields]
+    except KeyError:
+        record = collections.namedtuple('TagSnapshot', fields)
+        _snapshot_types[fields] = record
+        return record
+
+
+def read_tags(path, fields=None, fast=False, **kwargs):
+    """Read `fields` of the file at `path` in a single pass and return
+    them as a compact record, see `MediaFile.snapshot`. Other keyword
+    arguments are passed to `MediaFile`. May throw `UnreadableFileError`.
+
+    With `fast`, when all the fields are in `FAST_FIELDS`, the common
+    cases of MP3, FLAC and Ogg Vorbis files are read directly from the
+    tags, with the same values. Other files, and any unusual tag, are
+    read by `MediaFile`.
+    """
+    if fast and fields is not None and FAST_FIELDS.issuperset(fields) and \
+       not _is_fileobj(path):
+        try:
+            values = _read_fast(path, fields)
+        except Exception as exc:
+            log.debug(u'fast read of %r failed: %s',
+                      path, six.text_type(exc))
+            values = None
+        if values is not None:
+            return _snapshot_type(tuple(fields))._make(values)
+    return MediaFile(path, cache=True, **kwargs).snapshot(fields)
@@ -1,26 +1,45 @@
 import mimetypes
 import os
+import time
 
 from flask import Response, request
 from werkzeug.datastructures import Headers
 
-from dbtables import Track
+import config
 
-def stream_audio():
-    song = Track.query.get(int(request.args.get('oid')))
+# Seconds between touches of the heartbeat while streaming.
+HEARTBEAT_INTERVAL = 5
 
-    if song == None:
-        return None
+# Touch config.STREAM_HEARTBEAT, so a running scan knows audio is being
+# streamed and backs off.
+def touch_heartbeat():
+    path = getattr(config, 'STREAM_HEARTBEAT', None)
+    if path == None:
+        return
+    try:
+        with open(path, 'a'):
+            os.utime(path)
+    except OSError:
+        pass
 
+# Stream the file of the track, using the size and MIME type stored by the
+# scanner. Returns None when the file can't be opened.
+def stream_audio(song):
     path = song.filename
     path_encoded = path.encode('utf-8')
 
-    if os.path.exists(path_encoded) == False:
+    try:
+        handle = open(path_encoded, "rb")
+    except OSError:
         return None
 
-    # Find the file and guess type
-    mime = mimetypes.guess_type(path)[0]
-    size = os.path.getsize(path_encoded)
+    # Tracks not scanned again since it was added miss it.
+    mime = song.mime
+    if mime == None:
+        mime = mimetypes.guess_type(path)[0]
+    # The file may have changed since the scan, so the ranges are served
+    # from the size of what is open, not the stored one.
+    size = os.fstat(handle.fileno()).st_size
 
     # Send some extra headers
     headers = Headers()
@@ -43,6 +62,7 @@ def stream_audio():
 
     # Make sure range_start and range_end are withing size limits
     if range_start >= size:
+        handle.close()
         return Response("", mimetype=mime, headers=headers, status=416)
     else:
         content_length = (range_end + 1) - range_start
@@ -51,12 +71,16 @@ def stream_audio():
         status = 206
 
     def generate_audio():
-        with open(path_encoded, "rb") as handle:
+        with handle:
             handle.seek(range_start)
             left = content_length
+            touched = 0
             while left:
+                if time.monotonic() - touched > HEARTBEAT_INTERVAL:
+                    touch_heartbeat()
+                    touched = time.monotonic()
                 r = 4096 if 4096 < left else left
-                data = handle.read(4096)
+                data = handle.read(r)
                 left -= r
                 yield data
 
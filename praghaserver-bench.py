@@ -0,0 +1,519 @@
+#!/usr/bin/env python3
+import argparse
+import importlib.util
+import json
+import multiprocessing.forkserver
+import os, sys
+import random
+import resource
+import shutil
+import struct
+import subprocess
+import tempfile
+import time
+
+import mutagen.flac
+import mutagen.id3
+import mutagen.mp4
+import mutagen.ogg
+import mutagen.oggvorbis
+from sqlalchemy import event
+from tabulate import tabulate
+
+import config
+
+SAMPLE_RATE = 44100
+
+GENRES = ['Rock', 'Pop', 'Jazz', 'Electronic', 'Hip-Hop', 'Classical', 'Metal', 'Folk', 'Blues', 'Reggae',
+          'Soul', 'Punk', 'Country', 'Ambient', 'Latin', 'Funk', 'Indie', 'Soundtrack', 'World', 'Experimental']
+
+WORDS = ['love', 'night', 'blue', 'river', 'fire', 'dream', 'city', 'road', 'heart', 'light', 'rain', 'song',
+         'ghost', 'summer', 'golden', 'wild', 'silence', 'corazón', 'noche', 'étoile', 'Straße', 'ветер', '夜']
+
+# Share of the generated files of each format.
+FORMATS = [('mp3', 0.55), ('flac', 0.25), ('ogg', 0.1), ('m4a', 0.1)]
+
+
+# Minimal audio files, with a valid header but silent (or garbage) audio.
+
+def make_mp3(path, seconds):
+    # MPEG-1 Layer III, 128 kbps, 44.1 kHz, joint stereo: 417 bytes frames.
+    frame = b'\xff\xfb\x90\x64' + b'\x00' * 413
+    with open(path, 'wb') as f:
+        f.write(frame * 8)
+
+
+def make_flac(path, seconds):
+    bits = (SAMPLE_RATE << 44) | (1 << 41) | (15 << 36) | (seconds * SAMPLE_RATE)
+    info = struct.pack('>HH', 4096, 4096) + b'\x00' * 6 + struct.pack('>Q', bits) + b'\x00' * 16
+    with open(path, 'wb') as f:
+        f.write(b'fLaC' + b'\x80' + struct.pack('>I', len(info))[1:] + info + b'\xff\xf8' + b'\x00' * 256)
+
+
+def make_ogg(path, seconds):
+    ident = b'\x01vorbis' + struct.pack('<IBIiiiBB', 0, 2, SAMPLE_RATE, 0, 128000, 0, 0xb8, 1)
+    comment = b'\x03vorbis' + struct.pack('<I', 5) + b'bench' + struct.pack('<I', 0) + b'\x01'
+    setup = b'\x05vorbis' + b'\x00' * 32
+    pages = []
+    for sequence, packets, position in ((0, [ident], 0), (1, [comment, setup], 0),
+                                        (2, [b'\x00' * 256], seconds * SAMPLE_RATE)):
+        page = mutagen.ogg.OggPage()
+        page.serial = 0x50524147
+        page.sequence = sequence
+        page.position = position
+        page.packets = packets
+        page.first = sequence == 0
+        page.last = sequence == 2
+        pages.append(page.write())
+    with open(path, 'wb') as f:
+        f.write(b''.join(pages))
+
+
+def atom(name, data):
+    return struct.pack('>I4s', 8 + len(data), name) + data
+
+
+def full_atom(name, version, flags, data):
+    return atom(name, struct.pack('>I', (version << 24) | flags) + data)
+
+
+def make_m4a(path, seconds):
+    matrix = struct.pack('>9I', 0x10000, 0, 0, 0, 0x10000, 0, 0, 0, 0x40000000)
+    mdat = atom(b'mdat', b'\x00' * 256)
+
+    def moov(offset):
+        mvhd = full_atom(b'mvhd', 0, 0, struct.pack('>IIII', 0, 0, 1000, seconds * 1000) +
+                         b'\x00\x01\x00\x00\x01\x00' + b'\x00' * 10 + matrix + b'\x00' * 24 + struct.pack('>I', 2))
+        tkhd = full_atom(b'tkhd', 0, 7, struct.pack('>IIIII', 0, 0, 1, 0, seconds * 1000) + b'\x00' * 8 +
+                         struct.pack('>HHHH', 0, 0, 0x100, 0) + matrix + struct.pack('>II', 0, 0))
+        mdhd = full_atom(b'mdhd', 0, 0, struct.pack('>IIIIHH', 0, 0, SAMPLE_RATE, seconds * SAMPLE_RATE, 0x55c4, 0))
+        hdlr = full_atom(b'hdlr', 0, 0, struct.pack('>I4s', 0, b'soun') + b'\x00' * 12 + b'SoundHandler\x00')
+        esds = full_atom(b'esds', 0, 0, b'\x03\x19\x00\x01\x00\x04\x11\x40\x15\x00\x00\x00' +
+                         struct.pack('>II', 128000, 128000) + b'\x05\x02\x12\x10\x06\x01\x02')
+        mp4a = atom(b'mp4a', b'\x00' * 6 + struct.pack('>H', 1) + b'\x00' * 8 +
+                    struct.pack('>HHHHI', 2, 16, 0, 0, SAMPLE_RATE << 16) + esds)
+        stbl = atom(b'stbl', full_atom(b'stsd', 0, 0, struct.pack('>I', 1) + mp4a) +
+                    full_atom(b'stts', 0, 0, struct.pack('>III', 1, 1, seconds * SAMPLE_RATE)) +
+                    full_atom(b'stsc', 0, 0, struct.pack('>IIII', 1, 1, 1, 1)) +
+                    full_atom(b'stsz', 0, 0, struct.pack('>III', 0, 1, 256)) +
+                    full_atom(b'stco', 0, 0, struct.pack('>II', 1, offset)))
+        dinf = atom(b'dinf', full_atom(b'dref', 0, 0, struct.pack('>I', 1) + full_atom(b'url ', 0, 1, b'')))
+        minf = atom(b'minf', full_atom(b'smhd', 0, 0, b'\x00' * 4) + dinf + stbl)
+        return atom(b'moov', mvhd + atom(b'trak', tkhd + atom(b'mdia', mdhd + hdlr + minf)))
+
+    ftyp = atom(b'ftyp', b'M4A \x00\x00\x02\x00M4A mp42isom')
+    with open(path, 'wb') as f:
+        f.write(ftyp + moov(len(ftyp) + len(moov(0)) + 8) + mdat)
+
+
+# Tagging, with mutagen's own interface of each format.
+
+def tag_mp3(path, tags):
+    id3 = mutagen.id3.ID3()
+    id3.add(mutagen.id3.TIT2(encoding=3, text=tags['title']))
+    id3.add(mutagen.id3.TPE1(encoding=3, text=tags['artist']))
+    if tags['album']:
+        id3.add(mutagen.id3.TALB(encoding=3, text=tags['album']))
+    if tags['genre']:
+        id3.add(mutagen.id3.TCON(encoding=3, text=tags['genre']))
+    if tags['comment']:
+        id3.add(mutagen.id3.COMM(encoding=3, lang='eng', desc='', text=tags['comment']))
+    id3.add(mutagen.id3.TRCK(encoding=3, text='{}/{}'.format(tags['track'], tags['tracktotal'])))
+    id3.add(mutagen.id3.TDRC(encoding=3, text=str(tags['year'])))
+    id3.save(path)
+
+
+def tag_vorbis(path, tags, kind):
+    f = kind(path)
+    if f.tags is None:
+        f.add_tags()
+    f['title'] = tags['title']
+    f['artist'] = tags['artist']
+    for key in ('album', 'genre', 'comment'):
+        if tags[key]:
+            f[key] = tags[key]
+    f['tracknumber'] = str(tags['track'])
+    f['tracktotal'] = str(tags['tracktotal'])
+    f['date'] = str(tags['year'])
+    f.save()
+
+
+def tag_m4a(path, tags):
+    f = mutagen.mp4.MP4(path)
+    if f.tags is None:
+        f.add_tags()
+    f['\xa9nam'] = tags['title']
+    f['\xa9ART'] = tags['artist']
+    for key, value in (('\xa9alb', tags['album']), ('\xa9gen', tags['genre']), ('\xa9cmt', tags['comment'])):
+        if value:
+            f[key] = value
+    f['trkn'] = [(tags['track'], tags['tracktotal'])]
+    f['\xa9day'] = str(tags['year'])
+    f.save()
+
+
+WRITERS = {
+    'mp3': (make_mp3, tag_mp3),
+    'flac': (make_flac, lambda path, tags: tag_vorbis(path, tags, mutagen.flac.FLAC)),
+    'ogg': (make_ogg, lambda path, tags: tag_vorbis(path, tags, mutagen.oggvorbis.OggVorbis)),
+    'm4a': (make_m4a, tag_m4a),
+}
+
+
+def words(rnd, count):
+    return ' '.join(rnd.choice(WORDS) for i in range(count)).capitalize()
+
+
+# Albums of 8 to 16 tracks, artists with Zipf-like album counts, skewed
+# genres and a few files without album, genre or comment.
+def generate_library(path, count, seed):
+    rnd = random.Random(seed)
+    formats = [name for name, share in FORMATS]
+    weights = [share for name, share in FORMATS]
+    artists = ['{} {}'.format(words(rnd, 2), n) for n in range(max(1, count // 40))]
+
+    files = 0
+    while files < count:
+        artist = artists[min(int(rnd.paretovariate(1.2)) - 1, len(artists) - 1)]
+        album = '{} ({})'.format(words(rnd, rnd.randint(1, 4)), files)
+        year = rnd.randint(1955, 2024)
+        genre = GENRES[min(int(rnd.expovariate(0.25)), len(GENRES) - 1)]
+        kind = rnd.choices(formats, weights)[0]
+        folder = os.path.join(path, artist, album)
+        os.makedirs(folder, exist_ok=True)
+
+        # Most albums come with their cover, which the scan must skip.
+        if rnd.random() < 0.8:
+            with open(os.path.join(folder, 'cover.jpg'), 'wb') as f:
+                f.write(b'\xff\xd8\xff\xe0' + os.urandom(512))
+
+        tracktotal = rnd.randint(8, 16)
+        for track in range(1, min(tracktotal, count - files) + 1):
+            tags = {
+                'title': words(rnd, rnd.randint(1, 5)),
+                'artist': artist,
+                'album': album if rnd.random() > 0.02 else '',
+                'genre': genre if rnd.random() > 0.1 else '',
+                'comment': 'Ripped by bench' if rnd.random() < 0.3 else '',
+                'track': track,
+                'tracktotal': tracktotal,
+                'year': year,
+            }
+            filename = os.path.join(folder, '{:02d} {}.{}'.format(track, tags['title'], kind))
+            make, tag = WRITERS[kind]
+            make(filename, rnd.randint(120, 420))
+            tag(filename, tags)
+            files += 1
+    return files
+
+
+# Change the title of a share of the files, as a day of retagging would.
+def retag_library(path, share, seed):
+    rnd = random.Random(seed)
+    changed = 0
+    for folder, subfolders, filenames in os.walk(path):
+        for filename in filenames:
+            if filename.endswith('.jpg') or rnd.random() >= share:
+                continue
+            f = mutagen.File(os.path.join(folder, filename))
+            if isinstance(f, mutagen.mp4.MP4):
+                f['\xa9nam'] = 'Retagged'
+            elif isinstance(f.tags, mutagen.id3.ID3):
+                f.tags.add(mutagen.id3.TIT2(encoding=3, text='Retagged'))
+            else:
+                f['title'] = 'Retagged'
+            f.save()
+            changed += 1
+    return changed
+
+
+# Tags the readers of the scanner treat apart, on a share of the files of
+# the library: other text encodings, ID3v2.3 and ID3v1, several values,
+# comments with a description, alternative Vorbis keys, odd track and
+# date values and embedded pictures.
+MP3_VARIANTS = ['v23', 'v23_tyer', 'id3v1', 'utf16', 'latin1', 'comm_desc', 'multi', 'track_text', 'no_track', 'picture']
+VORBIS_VARIANTS = ['description', 'track_key', 'year_key', 'full_date', 'multi', 'track_text', 'empty', 'picture']
+
+
+def vary_mp3(path, variant, rnd):
+    f = mutagen.id3.ID3(path)
+    if variant == 'v23_tyer':
+        date = str(f['TDRC'].text[0])
+        f.delall('TDRC')
+        f.add(mutagen.id3.TYER(encoding=0, text=date))
+        f.add(mutagen.id3.TDAT(encoding=0, text='{:02d}{:02d}'.format(rnd.randint(1, 28), rnd.randint(1, 12))))
+        f.save(v2_version=3)
+        return
+    if variant == 'v23':
+        f.save(v2_version=3)
+        return
+    if variant == 'id3v1':
+        f.save(v1=2)
+        return
+    if variant in ('utf16', 'latin1'):
+        encoding = 1 if variant == 'utf16' else 0
+        for frame in f.values():
+            if hasattr(frame, 'encoding'):
+                frame.encoding = encoding
+                if encoding == 0:
+                    frame.text = [text.encode('latin1', 'replace').decode('latin1') for text in frame.text]
+    elif variant == 'comm_desc':
+        f.add(mutagen.id3.COMM(encoding=3, lang='eng', desc='iTunNORM', text=' 0000021C 00000226'))
+        f.add(mutagen.id3.COMM(encoding=3, lang='fra', desc='', text='Commentaire'))
+    elif variant == 'multi':
+        f.add(mutagen.id3.TPE1(encoding=3, text=[words(rnd, 2), words(rnd, 2)]))
+        f.add(mutagen.id3.TCON(encoding=3, text=['(17)Rock', 'Jazz']))
+    elif variant == 'track_text':
+        f.add(mutagen.id3.TRCK(encoding=3, text='A1'))
+    elif variant == 'no_track':
+        f.delall('TRCK')
+    elif variant == 'picture':
+        f.add(mutagen.id3.APIC(encoding=3, mime='image/jpeg', type=3, desc='Cover',
+                               data=b'\xff\xd8\xff\xe0' + os.urandom(64 * 1024)))
+    f.save()
+
+
+def vary_vorbis(path, variant, rnd):
+    f = mutagen.File(path)
+    if variant == 'description':
+        f['description'] = words(rnd, 3)
+        f['comment'] = words(rnd, 3)
+    elif variant == 'track_key':
+        f['track'] = f.pop('tracknumber')
+    elif variant == 'year_key':
+        f['year'] = f.pop('date')
+    elif variant == 'full_date':
+        f['date'] = '{}-{:02d}-{:02d}'.format(f['date'][0], rnd.randint(1, 12), rnd.randint(1, 28))
+    elif variant == 'multi':
+        f['artist'] = [words(rnd, 2), words(rnd, 2)]
+    elif variant == 'track_text':
+        f['tracknumber'] = 'A1'
+    elif variant == 'empty':
+        f['album'] = ''
+        f['description'] = ''
+    elif variant == 'picture':
+        if isinstance(f, mutagen.flac.FLAC):
+            picture = mutagen.flac.Picture()
+            picture.type = 3
+            picture.mime = 'image/jpeg'
+            picture.data = b'\xff\xd8\xff\xe0' + os.urandom(64 * 1024)
+            f.add_picture(picture)
+        else:
+            f['coverart'] = 'AAAA'
+    f.save()
+
+
+def vary_library(path, share, seed):
+    rnd = random.Random(seed)
+    varied = 0
+    for folder, subfolders, filenames in os.walk(path):
+        for filename in filenames:
+            if filename.endswith('.jpg') or filename.endswith('.m4a') or rnd.random() >= share:
+                continue
+            if filename.endswith('.mp3'):
+                vary_mp3(os.path.join(folder, filename), rnd.choice(MP3_VARIANTS), rnd)
+            else:
+                vary_vorbis(os.path.join(folder, filename), rnd.choice(VORBIS_VARIANTS), rnd)
+            varied += 1
+    return varied
+
+
+# Check that the fast tag readers give the values of MediaFile, and how
+# often they do not leave the file to it.
+def conformance(a):
+    from mediafile import FAST_FIELDS, MediaFile, read_tags, _read_fast
+
+    fields = sorted(FAST_FIELDS)
+    workdir = tempfile.mkdtemp(prefix='pragha-bench-')
+    library = a.library or os.path.join(workdir, 'music') + os.sep
+
+    try:
+        if not a.library:
+            files = generate_library(library, a.files, a.seed)
+            varied = vary_library(library, 0.5, a.seed + 1)
+            print('Generated {} files, {} with unusual tags'.format(files, varied))
+
+        paths = []
+        for folder, subfolders, filenames in os.walk(library):
+            paths.extend(os.path.join(folder, filename) for filename in filenames)
+
+        mismatches = []
+        fast = 0
+        fast_seconds = slow_seconds = 0.0
+        for path in sorted(paths):
+            start = time.perf_counter()
+            try:
+                expected = MediaFile(path).snapshot(fields)
+            except Exception:
+                continue
+            slow_seconds += time.perf_counter() - start
+
+            start = time.perf_counter()
+            record = read_tags(path, fields, fast=True, skip_art=True)
+            fast_seconds += time.perf_counter() - start
+            try:
+                fast += _read_fast(path, fields) is not None
+            except Exception:
+                pass
+
+            if record != expected:
+                mismatches.append([os.path.relpath(path, library)] +
+                                  ['{!r} != {!r}'.format(x, y) for field, x, y in zip(fields, record, expected) if x != y])
+
+        print(tabulate([['files', len(paths)], ['fast path', fast], ['mismatches', len(mismatches)],
+                        ['mediafile seconds', '{:.2f}'.format(slow_seconds)],
+                        ['read_tags seconds', '{:.2f}'.format(fast_seconds)]],
+                       tablefmt="grid", disable_numparse=True))
+        for mismatch in mismatches:
+            print(' '.join(mismatch))
+    finally:
+        if a.keep:
+            print('Library kept in ' + workdir)
+        else:
+            shutil.rmtree(workdir)
+
+    return 1 if mismatches else 0
+
+
+# Read calls and bytes of this process and of the reaped children, from
+# the kernel I/O accounting, or None where there is none.
+def read_counters():
+    try:
+        with open('/proc/self/io') as f:
+            counters = dict(line.split(': ') for line in f.read().splitlines())
+    except OSError:
+        return None
+    return int(counters['syscr']), int(counters['rchar'])
+
+
+def load_scanner():
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'praghaserver-scan.py')
+    spec = importlib.util.spec_from_file_location('praghaserver_scan', path)
+    scan = importlib.util.module_from_spec(spec)
+    # The worker processes find the scanner functions by module name.
+    sys.modules[spec.name] = scan
+    spec.loader.exec_module(scan)
+    return scan
+
+
+# The readers start from a fork server, which imports this file as
+# __mp_main__ and must find the scanner by its module name too. They
+# don't use the database.
+if __name__ == '__mp_main__':
+    config.DATABASE_URL = 'sqlite://'
+    load_scanner()
+
+
+# Runs in a child process per scenario so the peak RSS is its own.
+def run_scenario(a):
+    config.DATABASE_URL = 'sqlite:///' + a.database
+    config.MUSIC_DIR = a.library
+    scan = load_scanner()
+
+    # The tag cache of the workdir, never the one of the config.
+    tag_cache = os.path.join(os.path.dirname(a.database), 'tag-cache.db')
+    args = scan.get_parser().parse_args(['update', '--jobs', str(a.jobs), '--tag-cache', tag_cache] + a.scan_args)
+    scan.db.init_app(scan.app)
+    with scan.app.app_context():
+        queries = []
+        event.listen(scan.db.engine, 'before_cursor_execute', lambda *args: queries.append(1))
+
+        before = read_counters()
+        start = time.perf_counter()
+        scan.update_db(args)
+        elapsed = time.perf_counter() - start
+        # The readers are children of the fork server. Stop it so they
+        # count as reaped children too, in the reads and the peak RSS.
+        multiprocessing.forkserver._forkserver._stop()
+        after = read_counters()
+
+        tracks = scan.Track.query.count()
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Largest of the reaped worker processes.
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    with open(a.output, 'w') as f:
+        json.dump({
+            'seconds': elapsed,
+            'tracks': tracks,
+            'queries': len(queries),
+            'peak_rss_kb': rss,
+            'peak_worker_rss_kb': children,
+            'read_calls': after[0] - before[0] if before else None,
+            'read_mb': (after[1] - before[1]) / 1024 / 1024 if before else None,
+        }, f)
+
+
+def bench(a):
+    workdir = tempfile.mkdtemp(prefix='pragha-bench-')
+    library = os.path.join(workdir, 'music') + os.sep
+    database = os.path.join(workdir, 'pragha.db')
+
+    try:
+        start = time.perf_counter()
+        files = generate_library(library, a.files, a.seed)
+        print('Generated {} files in {:.1f}s'.format(files, time.perf_counter() - start))
+
+        results = []
+        scenarios = [('cold', None), ('incremental', a.changed), ('rebuild', None)]
+        for name, changed in scenarios:
+            if changed:
+                retag_library(library, changed, a.seed + 1)
+            # A new database, filled from the tag cache in the workdir.
+            if name == 'rebuild':
+                os.remove(database)
+
+            output = os.path.join(workdir, name + '.json')
+            subprocess.run([sys.executable, os.path.abspath(__file__), '--scenario', name,
+                            '--library', library, '--database', database, '--output', output,
+                            '--jobs', str(a.jobs)] + ['--scan-arg=' + arg for arg in a.scan_args],
+                           cwd=workdir, check=True, stdout=subprocess.DEVNULL)
+            with open(output) as f:
+                result = json.load(f)
+
+            result['scenario'] = name
+            result['files'] = files
+            result['files_per_sec'] = files / result['seconds']
+            result['queries_per_file'] = result['queries'] / files
+            if result['read_calls'] is not None:
+                result['read_calls_per_file'] = result['read_calls'] / files
+            results.append(result)
+
+        headers = ['scenario', 'files', 'tracks', 'seconds', 'files_per_sec', 'queries_per_file', 'read_calls_per_file', 'read_mb',
+                   'peak_rss_kb', 'peak_worker_rss_kb']
+        print(tabulate([[r.get(h) for h in headers] for r in results], headers, tablefmt="grid", floatfmt=".2f"))
+
+        if a.json:
+            with open(a.json, 'w') as f:
+                json.dump(results, f, indent=2)
+    finally:
+        if a.keep:
+            print('Library and database kept in ' + workdir)
+        else:
+            shutil.rmtree(workdir)
+
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the PraghaServer scanner on a generated library')
+    parser.add_argument('--files', type=int, default=2000, help='Number of music files to generate')
+    parser.add_argument('--seed', type=int, default=1, help='Seed of the generated library')
+    parser.add_argument('--changed', type=float, default=0.01, help='Share of the files retagged before the incremental scan')
+    parser.add_argument('--jobs', type=int, default=1, help='Processes reading tags')
+    parser.add_argument('--scan-arg', dest='scan_args', action='append', default=[], help='Extra argument for the scanner')
+    parser.add_argument('--json', type=str, help='Write the results to this file')
+    parser.add_argument('--keep', action='store_true', help='Keep the generated library')
+    parser.add_argument('--conformance', action='store_true',
+                        help='Compare the fast tag readers with MediaFile instead, on the generated library or --library')
+    parser.add_argument('--scenario', help=argparse.SUPPRESS)
+    parser.add_argument('--library', help='Library of --conformance')
+    parser.add_argument('--database', help=argparse.SUPPRESS)
+    parser.add_argument('--output', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.scenario:
+        exit(run_scenario(args))
+    if args.conformance:
+        exit(conformance(args))
+    exit(bench(args))
@@ -1,213 +1,1298 @@
 #!/usr/bin/env python3
 from flask import Flask
-from praghaserver import db, User, Session, Track, Title, Artist, Album, Genre, Comment
+from praghaserver import db, upgrade_db, User, Session, Track, Title, Artist, Album, Genre, Comment, ScanJournal, Quarantine, Folder
 
-from mediafile import MediaFile
+from mediafile import UnreadableFileError, has_supported_extension, is_supported, read_tags
+from sqlalchemy import bindparam, event, func, or_, text
 import argparse
+import collections
+import contextlib
+import ctypes, ctypes.util
+import fcntl
+import hashlib
+import heapq
+import itertools
+import json
+import mimetypes
+import multiprocessing
 import os, sys
+import queue
+import resource
+import select
+import sqlite3
+import struct
+import threading
+import time
 
-from progress.spinner import Spinner
+from progress.counter import Counter
 from progress.bar import Bar
 
+from inotify import Inotify, IN_CLOSE_WRITE, IN_MOVED_FROM, IN_MOVED_TO, IN_CREATE, IN_DELETE, IN_ONLYDIR, IN_ISDIR, IN_Q_OVERFLOW
+
 import config
 
 app = Flask(__name__)
 app.config['SQLALCHEMY_DATABASE_URI'] = config.DATABASE_URL
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'pool_pre_ping': True}
 
-spinner = Spinner('Searching music to scan... ')
-
-def get_title(title):
-    id = 0
-    dbTitle = Title.query.filter_by(name=title).first()
-    if dbTitle != None:
-        id = dbTitle.id
-    return id
-
-def new_title (title):
-    dbTitle = Title(title)
-    db.session.add(dbTitle)
-    #db.session.commit()
-    return get_title(title)
-
-def get_artist(artist):
-    id = 0
-    dbArtist = Artist.query.filter_by(name=artist).first()
-    if dbArtist != None:
-        id = dbArtist.id
-    return id
-
-def new_artist (artist):
-    dbArtist = Artist(artist)
-    db.session.add(dbArtist)
-    #db.session.commit()
-    return get_artist(artist)
-
-def get_album(album):
-    id = 0
-    dbAlbum = Album.query.filter_by(name=album).first()
-    if dbAlbum != None:
-        id = dbAlbum.id
-    return id
-
-def new_album (album):
-    dbAlbum = Album(album)
-    db.session.add(dbAlbum)
-    #db.session.commit()
-    return get_album(album)
-
-def get_genre(genre):
-    id = 0
-    dbGenre = Genre.query.filter_by(name=genre).first()
-    if dbGenre != None:
-        id = dbGenre.id
-    return id
-
-def new_genre (genre):
-    dbGenre = Genre(genre)
-    db.session.add(dbGenre)
-    #db.session.commit()
-    return get_genre(genre)
-
-def get_comment(comment):
-    id = 0
-    dbComment = Comment.query.filter_by(name=comment).first()
-    if dbComment != None:
-        id = dbComment.id
-    return id
-
-def new_comment (comment):
-    dbComment = Comment(comment)
-    db.session.add(dbComment)
-    #db.session.commit()
-    return get_comment(comment)
-
-def add_item_db (filename):
-    item = MediaFile(filename)
-    if item == None:
-        return
+# Watch daemon limits: longest wait for a burst of events to settle, and
+# most paths kept pending before falling back to a whole update.
+WATCH_MAX_DELAY = 30
+WATCH_MAX_PENDING = 10000
 
-    # Title and artist are mandatory,
-    if item.artist != None and item.title != None:
-        # Ignore dup tracks..
-        if Track.query.filter_by(filename=filename).first() != None:
+# Items read by the lanes waiting for the writer.
+LANE_QUEUE = 1000
+
+# Fields of the files the tracks are made of.
+TAG_FIELDS = ('title', 'artist', 'album', 'genre', 'comments', 'track', 'year', 'length',
+              'samplerate', 'bitdepth', 'channels', 'bitrate', 'bitrate_mode', 'format')
+
+# Audio properties stored with the tracks, after the tags.
+AUDIO_COLUMNS = ('samplerate', 'bitdepth', 'channels', 'bitrate', 'bitrate_mode', 'format', 'mime')
+
+# MIME types of the formats, else guessed from the file name.
+MIME_TYPES = {
+    'MP3': 'audio/mpeg',
+    'AAC': 'audio/mp4',
+    'ALAC': 'audio/mp4',
+    'OGG': 'audio/ogg',
+    'Opus': 'audio/ogg',
+    'FLAC': 'audio/flac',
+    'APE': 'audio/x-ape',
+    'WavPack': 'audio/x-wavpack',
+    'Musepack': 'audio/x-musepack',
+    'Windows Media': 'audio/x-ms-wma',
+    'AIFF': 'audio/aiff',
+}
+
+# Errors of the files that broke the tag reader, and are quarantined.
+QUARANTINE_REASONS = ("Parser error", "Parser crashed", "Out of memory", "Timed out")
+
+# Errors of the files read fine but without a track. They are kept with the
+# quarantine too, so they aren't read again until they change.
+REJECT_REASONS = ("Not a music file", "Missing tag", "Unreadable file")
+
+# Throttle: seconds since the last heartbeat a stream counts as active, and
+# largest multiple of the read time paused after each file while streaming.
+STREAM_IDLE = 15
+BACKOFF_MAX = 16
+
+# FIEMAP ioctl, to find where the data of a file starts on the disk.
+FS_IOC_FIEMAP = 0xC020660B
+FIEMAP = struct.Struct('QQIIII')
+FIEMAP_EXTENT = struct.Struct('QQQQQIIII')
+
+# ioprio_set(2) has no glibc wrapper, its syscall number per architecture.
+IOPRIO_SET = {'x86_64': 251, 'i386': 289, 'i686': 289, 'aarch64': 30, 'armv7l': 314, 'armv6l': 314}
+IOPRIO_WHO_PROCESS = 1
+IOPRIO_CLASS_IDLE = 3
+IOPRIO_CLASS_SHIFT = 13
+
+# Name to id map of a tag table, loaded once so lookups don't hit the
+# database. Missing names are collected and created together by create().
+class Dimension:
+    def __init__(self, model):
+        self.model = model
+        self.ids = dict(db.session.query(model.name, model.id))
+        self.missing = set()
+
+    def get(self, name):
+        id = self.ids.get(name)
+        if id == None:
+            self.missing.add(name)
+        return id
+
+    def create(self):
+        if not self.missing:
             return
 
-        # Handle nulls.
-        track = 0
-        if item.track != None:
-            track = item.track
+        # Ignore names already there, the database may compare them
+        # differently than python (e.g. case insensitive on MySQL).
+        insert = self.model.__table__.insert()
+        insert = insert.prefix_with('OR IGNORE', dialect='sqlite')
+        insert = insert.prefix_with('IGNORE', dialect='mysql')
+        db.session.execute(insert, [{'name': name} for name in self.missing])
 
-        year = 0
-        if item.year != None:
-            year = item.year
+        for names in chunked(self.missing, 500):
+            query = db.session.query(self.model.name, self.model.id)
+            for name, id in query.filter(self.model.name.in_(names)):
+                self.ids[name] = id
 
-        album = ""
-        if item.album != None:
-            album = item.album
+        # Resolve with the database collation what didn't match exactly.
+        for name in self.missing:
+            if name not in self.ids:
+                self.ids[name] = self.model.query.filter_by(name=name).first().id
+        self.missing.clear()
 
-        genre = ""
-        if item.genre != None:
-            genre = item.genre
+def get_fingerprint (st):
+    return (st.st_size, st.st_mtime_ns, st.st_ino)
 
-        comment = ""
-        if item.comments != None:
-            comment = item.comments
+# Fingerprints and errors of the quarantined and rejected files.
+def get_quarantine ():
+    query = db.session.query(Quarantine.filename, Quarantine.size, Quarantine.mtime, Quarantine.inode, Quarantine.reason)
+    return dict((row.filename, ((row.size, row.mtime, row.inode), row.reason)) for row in query)
 
-        # Get id or append new tag,
-        titleId = get_title(item.title)
-        if titleId == 0:
-            titleId = new_title(item.title)
+# Drop the paths inside other paths of the list.
+def collapse_paths (paths):
+    roots = []
+    for path in sorted(paths, key=lambda path: path.split(os.sep)):
+        if roots and path.startswith(roots[-1] + os.sep):
+            continue
+        roots.append(path)
+    return roots
 
-        artistId = get_artist(item.artist)
-        if artistId == 0:
-            artistId = new_artist(item.artist)
+# The roots of the collection: config.MUSIC_DIR is a folder or a list.
+def get_music_dirs ():
+    dirs = config.MUSIC_DIR
+    if isinstance(dirs, str):
+        dirs = [dirs]
+    return collapse_paths([os.path.normpath(path) for path in dirs])
 
-        albumId = get_album(album)
-        if albumId == 0:
-            albumId = new_album(album)
+def get_root (path, roots):
+    for root in roots:
+        if path == root or path.startswith(root + os.sep):
+            return root
+    return None
 
-        genreId = get_genre(genre)
-        if genreId == 0:
-            genreId = new_genre(genre)
+# The disk a folder is on. Partitions of the same disk share it.
+def get_device (path):
+    dev = os.stat(path).st_dev
+    block = '/sys/dev/block/{}:{}'.format(os.major(dev), os.minor(dev))
+    if os.path.exists(os.path.join(block, 'partition')):
+        return os.path.realpath(os.path.join(block, '..'))
+    return dev
 
-        commentId = get_comment(comment)
-        if commentId == 0:
-            commentId = new_comment(comment)
+# Group the roots in lanes, one per disk, so the disks are scanned at the
+# same time but each of them walked by a single thread.
+def get_lanes (roots):
+    lanes = collections.OrderedDict()
+    for root in roots:
+        lanes.setdefault(get_device(root), []).append(root)
+    return list(lanes.values())
 
-        dbTrack = Track(filename, titleId, artistId, albumId, genreId, commentId, track, year, item.length)
-        db.session.add(dbTrack)
-        #db.session.commit()
+# Fingerprints of the tracks in the database, or only of the given files
+# and the tracks inside the given folders.
+def get_known_tracks (paths=None):
+    query = db.session.query(Track.filename, Track.id, Track.size, Track.mtime, Track.inode, Track.format)
+    if paths == None:
+        queries = [query]
     else:
-        with open("error.txt", "a") as myfile:
-            myfile.write("Missing tag for: " + filename + "\n")
-
-def scan_folder (bar, path):
-    for item in os.listdir(path):
-        fullpath = os.path.join(path, item)
-        if os.path.isdir (fullpath):
-            scan_folder (bar, fullpath)
+        queries = []
+        for chunk in chunked(paths, 100):
+            queries.append(query.filter(or_(*[or_(Track.filename == path, Track.filename.startswith(path + os.sep, autoescape=True)) for path in chunk])))
+
+    # Tracks scanned before the audio properties were kept have no format,
+    # so without a fingerprint they are read again once to get them.
+    known = {}
+    for query in queries:
+        for row in query:
+            fingerprint = (row.size, row.mtime, row.inode) if row.format != None else None
+            known[row.filename] = (row.id, fingerprint)
+    return known
+
+# Timers and counters of a scan, written as JSON at the end of update.
+# The lanes update it from their threads, so it takes a lock and keeps
+# the current phase per thread.
+class ScanReport:
+    SLOWEST = 20
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.errors = None
+        self.start()
+
+    def start(self):
+        self.started = time.time()
+        self.phases = collections.Counter()
+        self.queries = collections.Counter()
+        self.files = collections.Counter()
+        self.skipped = collections.Counter()
+        self.formats = collections.defaultdict(lambda: {'files': 0, 'seconds': 0.0})
+        self.slowest = []
+
+    # Time spent in each phase, and the queries issued during it.
+    @contextlib.contextmanager
+    def timer(self, phase):
+        previous = getattr(self.local, 'phase', None)
+        self.local.phase = phase
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.phases[phase] += time.perf_counter() - start
+            self.local.phase = previous
+
+    def count_query(self, *args):
+        with self.lock:
+            self.queries[getattr(self.local, 'phase', None)] += 1
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.files[name] += n
+
+    # The time a worker (or the scanner itself) took to read a file.
+    def parsed(self, filename, seconds):
+        with self.lock:
+            self.phases['parse'] += seconds
+        stats = self.formats[os.path.splitext(filename)[1][1:].lower()]
+        stats['files'] += 1
+        stats['seconds'] += seconds
+
+        heapq.heappush(self.slowest, (seconds, filename))
+        if len(self.slowest) > self.SLOWEST:
+            heapq.heappop(self.slowest)
+
+    def skip(self, filename, reason, log=True):
+        with self.lock:
+            self.skipped[reason] += 1
+            if log:
+                if self.errors == None:
+                    self.errors = open("error.txt", "a")
+                self.errors.write(reason + " for: " + filename + "\n")
+
+    def close(self):
+        if self.errors != None:
+            self.errors.close()
+            self.errors = None
+
+    def write(self, path):
+        self.close()
+        report = {
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started)),
+            'seconds': time.time() - self.started,
+            'files': dict(self.files),
+            'skipped': dict(self.skipped),
+            'phases': dict((phase, {'seconds': seconds, 'queries': self.queries[phase]})
+                           for phase, seconds in self.phases.items()),
+            'queries': sum(self.queries.values()),
+            'formats': self.formats,
+            'slowest': [{'filename': filename, 'seconds': seconds}
+                        for seconds, filename in sorted(self.slowest, reverse=True)],
+        }
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2)
+
+report = ScanReport()
+
+# Hash of the first and last 64 KiB of the file, which with its size and
+# tags identifies a moved file.
+def get_signature (filename, size):
+    block = 64 * 1024
+    digest = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        digest.update(f.read(block))
+        if size > block:
+            f.seek(max(block, size - block))
+            digest.update(f.read(block))
+    return digest.hexdigest()
+
+# Bytes read so far by this thread, from the kernel I/O accounting.
+def get_read_bytes ():
+    try:
+        with open('/proc/thread-self/io', 'rb') as f:
+            for line in f:
+                if line.startswith(b'rchar:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+# Only use the disk when nobody else does. The threads and processes
+# started later inherit it.
+def set_idle_io ():
+    number = IOPRIO_SET.get(os.uname().machine)
+    if number == None:
+        return False
+    libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+    return libc.syscall(number, IOPRIO_WHO_PROCESS, 0, IOPRIO_CLASS_IDLE << IOPRIO_CLASS_SHIFT) == 0
+
+# Keeps a scan from starving the streams. It caps the files and bytes read
+# per second across all the lanes, and while the server streams (the
+# heartbeat was touched lately) pauses after each file for a multiple of
+# the time it took to read it, doubling every second streams go on.
+class Throttle:
+    def __init__(self, files=0, mbytes=0, heartbeat=None):
+        self.files = files
+        self.bytes = mbytes * 1024 * 1024
+        self.heartbeat = heartbeat
+        self.backoff = 0
+        self.next = 0
+        self.checked = 0
+        self.lock = threading.Lock()
+
+    def enabled(self):
+        return bool(self.files or self.bytes or self.heartbeat)
+
+    def check_streams(self, now):
+        if self.heartbeat == None or now - self.checked < 1:
+            return
+        self.checked = now
+        try:
+            streaming = time.time() - os.stat(self.heartbeat).st_mtime < STREAM_IDLE
+        except OSError:
+            streaming = False
+        if streaming:
+            self.backoff = min(max(1, self.backoff * 2), BACKOFF_MAX)
+        else:
+            self.backoff = 0
+
+    # Called after reading each file, waits until the next one may be read.
+    def wait(self, nbytes, seconds):
+        cost = 0
+        if self.files:
+            cost = 1 / self.files
+        if self.bytes:
+            cost = max(cost, nbytes / self.bytes)
+
+        with self.lock:
+            now = time.monotonic()
+            self.check_streams(now)
+            self.next = max(self.next, now) + cost + seconds * self.backoff
+            delay = self.next - now
+        if delay > 0:
+            with report.timer('throttle'):
+                time.sleep(delay)
+
+# Tags of the files read before, in a sqlite file of its own so they
+# survive clean and a rebuild of the database. Keyed by device, inode, size
+# and mtime, so a file added again, or moved on the same disk, is not read
+# again. Used by the reader processes, each with its own connection.
+class TagCache:
+    # Bump when the cached tags change, it empties the cache.
+    VERSION = 2
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = None
+        self.pending = []
+
+    def connect(self):
+        if self.conn == None:
+            self.conn = sqlite3.connect(self.path, timeout=60)
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('PRAGMA synchronous=NORMAL')
+            if self.conn.execute('PRAGMA user_version').fetchone()[0] != self.VERSION:
+                self.conn.execute('DROP TABLE IF EXISTS tags')
+                self.conn.execute('PRAGMA user_version={}'.format(self.VERSION))
+            self.conn.execute('CREATE TABLE IF NOT EXISTS tags (dev INTEGER, inode INTEGER, size INTEGER, mtime INTEGER, '
+                              'tags TEXT NOT NULL, signature TEXT, PRIMARY KEY (dev, inode, size, mtime)) WITHOUT ROWID')
+        return self.conn
+
+    def get(self, key):
+        row = self.connect().execute('SELECT tags, signature FROM tags WHERE dev = ? AND inode = ? AND size = ? AND mtime = ?', key).fetchone()
+        if row == None:
+            return None
+        return tuple(json.loads(row[0])), row[1]
+
+    def put(self, key, tags, signature):
+        self.pending.append(key + (json.dumps(tags), signature))
+
+    def commit(self):
+        if self.pending:
+            self.connect().executemany('INSERT OR REPLACE INTO tags VALUES (?, ?, ?, ?, ?, ?)', self.pending)
+            self.conn.commit()
+            self.pending = []
+
+# The path of the tag cache, or None when it is disabled or can't be used.
+def check_tag_cache (path):
+    if not path:
+        return None
+    try:
+        TagCache(path).connect().close()
+    except sqlite3.Error as e:
+        print("Can't open the tag cache {}: {}, scanning without it.".format(path, e))
+        return None
+    return path
+
+def get_cache_key (dev, fingerprint):
+    size, mtime, inode = fingerprint
+    return (dev, inode, size, mtime)
+
+# Read the tags of a file. Runs in the worker processes, so it must not
+# touch the database and returns only plain values: the tags, or None and
+# the reason why the file can't be added. The embedded pictures are not
+# needed, so they are skipped on disk, and the usual MP3, FLAC and Ogg
+# Vorbis tags are read without mutagen's objects. The other files are
+# parsed from a memory map; a file truncated meanwhile crashes the reader
+# and is quarantined.
+def read_item (filename):
+    # Reject the files that aren't music before handing them to mutagen.
+    if not is_supported(filename):
+        return None, "Not a music file"
+
+    try:
+        item = read_tags(filename, TAG_FIELDS, fast=True, skip_art=True, use_mmap=True)
+    except UnreadableFileError:
+        return None, "Unreadable file"
+    except MemoryError:
+        return None, "Out of memory"
+    except Exception:
+        # A bug of the parser, which this file triggers.
+        return None, "Parser error"
+
+    # Title and artist are mandatory,
+    if item.artist == None or item.title == None:
+        return None, "Missing tag"
+
+    # Handle nulls.
+    track = 0
+    if item.track != None:
+        track = item.track
+
+    year = 0
+    if item.year != None:
+        year = item.year
+
+    album = ""
+    if item.album != None:
+        album = item.album
+
+    genre = ""
+    if item.genre != None:
+        genre = item.genre
+
+    comment = ""
+    if item.comments != None:
+        comment = item.comments
+
+    mime = MIME_TYPES.get(item.format)
+    if mime == None:
+        mime = mimetypes.guess_type(filename)[0]
+
+    return (item.title, item.artist, album, genre, comment, track, year, item.length,
+            item.samplerate, item.bitdepth, item.channels, item.bitrate, item.bitrate_mode or None, item.format, mime), None
+
+# Buffers the scanned tracks and writes them in batches: the tags missing
+# in the database are created with a single insert per table, the tracks
+# with one executemany, and every batch is committed on its own so the
+# memory stays flat and the database isn't locked for the whole scan.
+#
+# When given a scan id, each batch also adds a ScanJournal row with the
+# last folder it completed in each root, so an interrupted scan can be
+# resumed.
+class TrackWriter:
+    def __init__(self, batch_size=500, scan=None, roots=()):
+        self.batch_size = batch_size
+        self.scan = scan
+        self.roots = roots
+        self.folders = {}
+        self.done = {}
+        self.pending = []
+        self.quarantined = []
+        self.titles = Dimension(Title)
+        self.artists = Dimension(Artist)
+        self.albums = Dimension(Album)
+        self.genres = Dimension(Genre)
+        self.comments = Dimension(Comment)
+
+        table = Track.__table__
+        self.insert = table.insert()
+        self.update = table.update().where(table.c.id == bindparam('track_id'))
+
+    def add_item_db (self, filename, tags, fingerprint=(None, None, None), trackId=None, error=None, signature=None):
+        # Files of a root arrive in walk order, a new folder completes the
+        # previous one.
+        folder = os.path.dirname(filename)
+        root = get_root(folder, self.roots)
+        if folder != self.folders.get(root):
+            if root in self.folders:
+                self.done[root] = self.folders[root]
+            self.folders[root] = folder
+
+        if tags == None:
+            report.skip(filename, error, log=error != "Not a music file")
+            if error in QUARANTINE_REASONS or error in REJECT_REASONS:
+                self.quarantined.append((filename, fingerprint, error))
+                self.check_batch()
+            return
+
+        title, artist, album, genre, comment = tags[:5]
+        with report.timer('lookup'):
+            self.titles.get(title)
+            self.artists.get(artist)
+            self.albums.get(album)
+            self.genres.get(genre)
+            self.comments.get(comment)
+
+        self.pending.append((filename, tags, fingerprint, trackId, signature))
+        self.check_batch()
+
+    # Quarantined files count too, or a broken part of the library would
+    # pile them up in memory.
+    def check_batch (self):
+        if len(self.pending) + len(self.quarantined) >= self.batch_size:
+            self.flush()
+
+    def flush (self):
+        with report.timer('lookup'):
+            for dimension in (self.titles, self.artists, self.albums, self.genres, self.comments):
+                dimension.create()
+
+        inserts = []
+        updates = []
+        for filename, tags, fingerprint, trackId, signature in self.pending:
+            title, artist, album, genre, comment, track, year, length = tags[:8]
+            size, mtime, inode = fingerprint
+            row = {
+                'filename': filename,
+                'title_id': self.titles.ids[title],
+                'artist_id': self.artists.ids[artist],
+                'album_id': self.albums.ids[album],
+                'genre_id': self.genres.ids[genre],
+                'comment_id': self.comments.ids[comment],
+                'track': track,
+                'year': year,
+                'length': length,
+                'size': size,
+                'mtime': mtime,
+                'inode': inode,
+                'signature': signature,
+            }
+            row.update(zip(AUDIO_COLUMNS, tags[8:]))
+            if trackId == None:
+                inserts.append(row)
+            else:
+                # Update the changed track in place to keep its id.
+                row['track_id'] = trackId
+                updates.append(row)
+
+        with report.timer('insert'):
+            if inserts:
+                db.session.execute(self.insert, inserts)
+            if updates:
+                db.session.execute(self.update, updates)
+
+            if self.quarantined:
+                filenames = [filename for filename, fingerprint, error in self.quarantined]
+                db.session.query(Quarantine).filter(Quarantine.filename.in_(filenames)).delete(synchronize_session=False)
+                for filename, fingerprint, error in self.quarantined:
+                    db.session.add(Quarantine(filename, *fingerprint, error, int(time.time())))
+
+            if self.scan != None:
+                for folder in self.done.values():
+                    db.session.add(ScanJournal(self.scan, folder, len(self.pending), int(time.time())))
+                self.done = {}
+
+        with report.timer('commit'):
+            db.session.commit()
+            db.session.expunge_all()
+
+        report.count('inserted', len(inserts))
+        report.count('updated', len(updates))
+        report.count('quarantined', sum(1 for filename, fingerprint, error in self.quarantined if error in QUARANTINE_REASONS))
+        self.pending = []
+        self.quarantined = []
+
+# Returns the job to read the file, or None when it is unchanged or
+# quarantined. Found files are taken out of known, so what is left after
+# the walk are the tracks deleted from disk.
+def check_item (filename, st, known, full=False, quarantine={}):
+    fingerprint = get_fingerprint(st)
+
+    # It broke the reader, or has no track, and didn't change since. Keep
+    # the track as it is.
+    old, error = quarantine.get(filename, (None, None))
+    if old == fingerprint:
+        known.pop(filename, None)
+        report.skip(filename, "Quarantined" if error in QUARANTINE_REASONS else error, log=False)
+        return None
+
+    trackId = None
+    if filename in known:
+        trackId, oldFingerprint = known.pop(filename)
+        # Unchanged since the last scan, so don't open it at all.
+        if not full and oldFingerprint == fingerprint:
+            report.count('unchanged')
+            return None
+
+    return (filename, fingerprint, trackId, st.st_dev)
+
+def walk_key (path):
+    return os.path.normpath(path).split(os.sep)
+
+# The folders of the last update, to skip the files of the ones that didn't
+# change. The mtime of a folder changes when entries are added, removed or
+# renamed in it, so with the same mtime it has the same files and folders.
+# It doesn't when a file is written in place though, hence only with prune.
+# Every folder is still stat'ed, but not listed, and neither are its files.
+class FolderIndex:
+    # Seconds before the scan a folder must be left alone to be trusted.
+    RACY = 2
+
+    def __init__(self, known, prune=False):
+        self.known = known
+        self.prune = prune
+        self.started = time.time_ns()
+        self.old = {}
+        self.children = collections.defaultdict(list)
+        self.tracks = collections.defaultdict(list)
+        self.seen = {}
+        self.stale = set()
+        if prune:
+            for row in db.session.query(Folder.path, Folder.mtime, Folder.files):
+                self.old[row.path] = (row.mtime, row.files)
+                self.children[os.path.dirname(row.path)].append(row.path)
+            for filename, (trackId, fingerprint) in known.items():
+                self.tracks[os.path.dirname(filename)].append(filename)
+                if fingerprint == None:
+                    self.stale.add(os.path.dirname(filename))
+
+    # The subfolders of the folder when it didn't change, or None to list it.
+    # Its tracks are taken out of known like the ones of the files found.
+    def check(self, folder, st):
+        old = self.old.get(folder)
+        if old == None or old[0] != st.st_mtime_ns:
+            return None
+        # It had files but none is known anymore, the tracks were cleaned
+        # away from under it.
+        if old[1] and folder not in self.tracks:
+            return None
+        # Some of its tracks must be read again.
+        if folder in self.stale:
+            return None
+        for filename in self.tracks.get(folder, ()):
+            self.known.pop(filename, None)
+        report.count('pruned', old[1])
+        self.seen[folder] = old
+        return sorted(self.children.get(folder, ()))
+
+    def record(self, folder, st, files):
+        mtime = st.st_mtime_ns
+        if mtime > self.started - self.RACY * 10**9:
+            mtime = None
+        self.seen[folder] = (mtime, files)
+
+    def save(self):
+        db.session.query(Folder).delete()
+        rows = [{'path': path, 'mtime': mtime, 'files': files} for path, (mtime, files) in self.seen.items()]
+        if rows:
+            db.session.execute(Folder.__table__.insert(), rows)
+        db.session.commit()
+
+# Walk the folder in a single pass without recursion. Yields the entries
+# of the files, scandir already knows which ones are folders.
+#
+# The order is deterministic: the files of a folder, then its subfolders
+# sorted by name. That is the order of walk_key(), so with resume, the
+# walk_key() of a folder, everything up to it is skipped. The files are
+# sorted by name too, or by inode with any other order, which saves seeks
+# on spinning disks when they are stat'ed.
+#
+# With a FolderIndex, the folders are recorded in it, and the ones that
+# didn't change are not listed.
+def walk_folder (path, resume=None, order='name', index=None):
+    folders = [path]
+    while folders:
+        folder = folders.pop()
+        try:
+            subfolders = None
+            if index != None:
+                st = os.stat(folder)
+                subfolders = index.check(folder, st)
+            if subfolders == None:
+                with os.scandir(folder) as entries:
+                    entries = sorted(entries, key=lambda entry: entry.name)
+        except FileNotFoundError:
+            # Removed since its parent was listed, like its files. A missing
+            # root is an error though, not an empty library.
+            if folder == path:
+                raise
+            continue
+        if subfolders == None:
+            skip = resume != None and walk_key(folder) <= resume
+            subfolders = []
+            files = []
+            for entry in entries:
+                if entry.is_dir():
+                    subfolders.append(entry.path)
+                else:
+                    files.append(entry)
+            if index != None:
+                index.record(folder, st, len(files))
+
+            if order != 'name':
+                files.sort(key=lambda entry: entry.inode())
+            if not skip:
+                yield from files
+
+        for subfolder in reversed(subfolders):
+            if resume != None:
+                key = walk_key(subfolder)
+                # Done with the whole subtree unless the checkpoint is inside.
+                if key < resume and resume[:len(key)] != key:
+                    continue
+            folders.append(subfolder)
+
+# Physical offset of the first extent of the file, or None when the file
+# system can't tell.
+def get_extent (filename):
+    buf = bytearray(FIEMAP.size + FIEMAP_EXTENT.size)
+    FIEMAP.pack_into(buf, 0, 0, 0xFFFFFFFFFFFFFFFF, 0, 0, 1, 0)
+    try:
+        fd = os.open(filename, os.O_RDONLY)
+        try:
+            fcntl.ioctl(fd, FS_IOC_FIEMAP, buf)
+        finally:
+            os.close(fd)
+    except OSError:
+        return None
+    if FIEMAP.unpack_from(buf)[3] == 0:
+        return None
+    return FIEMAP_EXTENT.unpack_from(buf, FIEMAP.size)[1]
+
+def get_extent_key (job):
+    filename, fingerprint = job[:2]
+    extent = get_extent(filename)
+    if extent == None:
+        return (1, fingerprint[2])
+    return (0, extent)
+
+# Sort the jobs of each folder by where their data is on the disk, so the
+# headers are read in a sweep. A whole folder is sorted at once, the order
+# of the folders is kept for the journal. Only the files to read are
+# asked, so an incremental scan doesn't open the unchanged ones.
+def extent_order (jobs):
+    for folder, group in itertools.groupby(jobs, key=lambda job: os.path.dirname(job[0])):
+        group = list(group)
+        with report.timer('order'):
+            group.sort(key=get_extent_key)
+        yield from group
+
+# The music files of the folder with their stat.
+def stat_folder (path, resume=None, order='name', index=None):
+    entries = walk_folder(path, resume, order, index)
+    while True:
+        with report.timer('walk'):
+            entry = next(entries, None)
+            if entry == None:
+                return
+
+        report.count('seen')
+        # Filter by name first, a stat is a round trip on network mounts.
+        if not has_supported_extension(entry.name):
+            report.skip(entry.path, "Not a music file", log=False)
+            continue
+        with report.timer('walk'):
+            try:
+                st = entry.stat()
+            except FileNotFoundError:
+                # Removed since the folder was listed.
+                continue
+        yield entry.path, st
+
+def scan_folder (path, known, full=False, resume=None, quarantine={}, order='name', index=None):
+    jobs = (check_item (filename, st, known, full, quarantine)
+            for filename, st in stat_folder(path, resume, order, index))
+    jobs = (job for job in jobs if job != None)
+    if order == 'extent':
+        jobs = extent_order(jobs)
+    yield from jobs
+
+# Like scan_folder, but only for the given files and folders.
+def scan_paths (paths, known, quarantine={}):
+    for path in paths:
+        try:
+            if os.path.isdir(path):
+                for entry in walk_folder(path):
+                    if not has_supported_extension(entry.name):
+                        continue
+                    job = check_item (entry.path, entry.stat(), known, quarantine=quarantine)
+                    if job != None:
+                        yield job
+            elif os.path.isfile(path) and has_supported_extension(path):
+                job = check_item (path, os.stat(path), known, quarantine=quarantine)
+                if job != None:
+                    yield job
+        except FileNotFoundError:
+            # Gone again while we look at it, the next event handles it.
+            continue
+
+def chunked (iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+# Read the tags of the jobs, adding them, the signature of the file, the
+# bytes read and the time it took to each job. Files found in the cache
+# read no bytes at all; with refresh, they are read and cached again.
+def read_items (jobs, cache=None, refresh=False):
+    items = []
+    for job in jobs:
+        filename, fingerprint, trackId, dev = job
+        start = time.perf_counter()
+        before = get_read_bytes()
+        key = cached = signature = None
+        try:
+            if cache != None:
+                key = get_cache_key(dev, fingerprint)
+                if not refresh:
+                    cached = cache.get(key)
+            if cached != None:
+                tags, signature = cached
+                items.append(job + (tags, None, signature, 0, time.perf_counter() - start))
+                continue
+
+            tags, error = read_item(filename)
+            if tags != None:
+                signature = get_signature(filename, fingerprint[0])
+                if key != None:
+                    cache.put(key, tags, signature)
+        except OSError:
+            tags, error = None, "Unreadable file"
+        nbytes = fingerprint[0]
+        if before != None:
+            nbytes = get_read_bytes() - before
+        items.append(job + (tags, error, signature, nbytes, time.perf_counter() - start))
+    return items
+
+# Main loop of a reader process. It reads the chunks of jobs it gets and
+# sends the items back one by one, so the pool knows which file it is on.
+# The memory it may allocate on top of what it inherited is capped.
+def reader_main (conn, memory, cache, refresh):
+    if memory:
+        with open('/proc/self/statm') as f:
+            size = int(f.read().split()[0]) * resource.getpagesize()
+        resource.setrlimit(resource.RLIMIT_AS, (size + memory, resource.RLIM_INFINITY))
+    cache = TagCache(cache) if cache else None
+
+    while True:
+        jobs = conn.recv()
+        if jobs == None:
+            return
+        for job in jobs:
+            conn.send(read_items([job], cache, refresh)[0])
+        if cache != None:
+            cache.commit()
+
+class Reader:
+    # The readers are started again from the lane threads, while the others
+    # hold locks; a fork would copy them locked. A fork server starts them
+    # from a process without threads instead.
+    context = multiprocessing.get_context('forkserver')
+
+    def __init__(self, memory, cache=None, refresh=False):
+        self.memory = memory
+        self.cache = cache
+        self.refresh = refresh
+        self.start()
+
+    def start(self):
+        self.conn, child = self.context.Pipe()
+        self.process = self.context.Process(target=reader_main, args=(child, self.memory, self.cache, self.refresh), daemon=True)
+        self.process.start()
+        child.close()
+
+    def stop(self, kill=False):
+        if kill:
+            self.process.kill()
         else:
-            add_item_db (fullpath)
-            bar.next()
-
-def remove_old ():
-    deleteList = []
-    dbSongs = Track.query.all()
-    for song in dbSongs:
-        if os.path.exists(song.filename) == False:
-            deleteList.append(song);
-    bar = Bar('Cleaning deleted files...', max=len(deleteList))
-    for song in deleteList:
-        db.session.delete(song)
-        bar.next()
+            try:
+                self.conn.send(None)
+            except OSError:
+                pass
+        # Don't hang on a process stuck in the kernel.
+        self.process.join(1)
+        self.conn.close()
+
+    # Whether the reader died of an exception in the scanner code, which
+    # printed its traceback, rather than of a signal.
+    def failed(self):
+        self.process.join(1)
+        return self.process.exitcode == 1
+
+# Processes reading the tags, so a file that crashes mutagen, makes it spin
+# or eat all the memory only costs that file. Each file gets timeout
+# seconds and memory bytes; a reader that goes over is killed and started
+# again, and the file is reported with the error to quarantine it.
+#
+# With the path of a TagCache, the readers take the tags from it when they
+# can, and add the ones they read.
+class ReaderPool:
+    def __init__(self, processes=1, timeout=30, memory=0, cache=None, refresh=False):
+        self.timeout = timeout
+        self.readers = [Reader(memory, cache, refresh) for i in range(max(1, processes))]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        for reader in self.readers:
+            reader.stop()
+
+    # Read the tags of the jobs, keeping only a few chunks in flight so the
+    # walk doesn't run ahead of the readers. The items come in job order.
+    def read(self, jobs, chunksize=32):
+        readers = itertools.cycle(self.readers)
+        pending = collections.deque()
+        for chunk in chunked(jobs, chunksize):
+            reader = next(readers)
+            reader.conn.send(chunk)
+            pending.append((reader, chunk))
+            if len(pending) >= len(self.readers) * 4:
+                yield from self.receive(pending)
+        while pending:
+            yield from self.receive(pending)
+
+    def receive(self, pending):
+        reader, chunk = pending.popleft()
+        for i, job in enumerate(chunk):
+            item = None
+            with report.timer('wait'):
+                try:
+                    if reader.conn.poll(self.timeout):
+                        item = reader.conn.recv()
+                    else:
+                        error = "Timed out"
+                except (EOFError, OSError):
+                    error = "Parser crashed"
+            if item != None:
+                yield item
+                continue
+            if error == "Parser crashed" and reader.failed():
+                raise RuntimeError("Tag reader failed on " + job[0])
+
+            # Start the reader again with what it had left.
+            reader.stop(kill=True)
+            reader.start()
+            if chunk[i + 1:]:
+                reader.conn.send(chunk[i + 1:])
+            for other, jobs in pending:
+                if other is reader:
+                    reader.conn.send(jobs)
+            yield job + (None, error, None, 0, self.timeout)
+
+# Walk and read each lane in its own thread, and yield the items of all of
+# them as they come, so a single writer adds them to the database.
+def scan_lanes (counter, lanes, readers, known, full=False, resume={}, quarantine={}, throttle=None, order='name', index=None):
+    items = queue.Queue(LANE_QUEUE)
+
+    def scan_lane (lane, reader):
+        try:
+            for root in lane:
+                jobs = scan_folder (root, known, full, resume.get(root), quarantine, order, index)
+                for item in reader.read(jobs):
+                    if throttle != None:
+                        nbytes, seconds = item[-2:]
+                        throttle.wait(nbytes, seconds)
+                    items.put(item)
+        except BaseException as e:
+            items.put(e)
+        else:
+            items.put(None)
+
+    for lane, reader in zip(lanes, readers):
+        threading.Thread(target=scan_lane, args=(lane, reader), daemon=True).start()
+
+    running = len(lanes)
+    while running:
+        try:
+            item = items.get(timeout=0.2)
+        except queue.Empty:
+            item = ()
+        counter.next(report.files['seen'] - counter.index)
+
+        if item == None:
+            running -= 1
+        elif isinstance(item, BaseException):
+            raise item
+        elif item:
+            yield item
+
+# The track columns aren't indexed, so the ids in use are collected once
+# per table instead of looking each row up in the tracks.
+def remove_orphans ():
+    for model, column in ((Title, Track.title_id), (Artist, Track.artist_id), (Album, Track.album_id),
+                          (Genre, Track.genre_id), (Comment, Track.comment_id)):
+        table = model.__table__
+        used = db.select(column).where(column != None)
+        db.session.execute(table.delete().where(table.c.id.not_in(used)))
+
+def remove_old (stale, orphans=True):
+    ids = [trackId for trackId, fingerprint in stale.values()]
+    table = Track.__table__
+    bar = Bar('Cleaning deleted files...', max=len(ids))
+    with report.timer('remove'):
+        for chunk in chunked(ids, 500):
+            db.session.execute(table.delete().where(table.c.id.in_(chunk)))
+            bar.next(len(chunk))
+
+        if orphans:
+            remove_orphans()
+        db.session.commit()
     bar.finish()
+    report.count('removed', len(ids))
+
+def get_last_track ():
+    return db.session.query(func.max(Track.id)).scalar() or 0
+
+# The stale tracks whose file shows up as one added after lastId were moved.
+# They are matched in a single pass over the new tracks: by fingerprint when
+# the file was renamed in place (same inode, size and mtime), else by size,
+# signature, title and artist. The old track takes the new file and tags,
+# and the new one is dropped, so the id known by the clients survives.
+def move_tracks (stale, lastId):
+    if not stale:
+        return
+
+    table = Track.__table__
+    byFingerprint = {}
+    bySignature = collections.defaultdict(list)
+    for filename, (trackId, fingerprint) in stale.items():
+        if fingerprint != None and fingerprint[2] != None:
+            byFingerprint[fingerprint] = filename
+    for chunk in chunked([trackId for trackId, fingerprint in stale.values()], 500):
+        query = db.select(table.c.id, table.c.filename, table.c.size, table.c.signature, table.c.title_id, table.c.artist_id)
+        for row in db.session.execute(query.where(table.c.id.in_(chunk), table.c.signature != None)):
+            bySignature[(row.size, row.signature, row.title_id, row.artist_id)].append(row.filename)
+
+    moved = []
+    added = []
+    for row in db.session.execute(db.select(table).where(table.c.id > lastId)):
+        filename = byFingerprint.pop((row.size, row.mtime, row.inode), None)
+        if filename == None or filename not in stale:
+            candidates = bySignature.get((row.size, row.signature, row.title_id, row.artist_id))
+            while candidates and filename not in stale:
+                filename = candidates.pop()
+        if filename not in stale:
+            continue
 
-def count_folder (path):
-    fileCount = 0
-    for item in os.listdir(path):
-        fullpath = os.path.join(path, item)
-        if os.path.isdir (fullpath):
-            spinner.next()
-            fileCount += count_folder (fullpath)
+        trackId, fingerprint = stale.pop(filename)
+        values = dict(row._mapping)
+        added.append(values.pop('id'))
+        values['track_id'] = trackId
+        moved.append(values)
+
+    if not moved:
+        return
+
+    with report.timer('move'):
+        for chunk in chunked(added, 500):
+            db.session.execute(table.delete().where(table.c.id.in_(chunk)))
+        db.session.execute(table.update().where(table.c.id == bindparam('track_id')), moved)
+        db.session.commit()
+    report.count('moved', len(moved))
+
+def import_items (writer, items):
+    for filename, fingerprint, trackId, dev, tags, error, signature, nbytes, seconds in items:
+        if tags != None and nbytes == 0:
+            report.count('cached')
         else:
-            fileCount += 1
-    return fileCount
+            report.count('read')
+            report.count('bytes', nbytes)
+            report.parsed(filename, seconds)
+        writer.add_item_db (filename, tags, fingerprint, trackId, error, signature)
+    writer.flush()
+    report.close()
 
 def update_db(a):
+    report.start()
+    if a.idle and not set_idle_io():
+        print("Can't lower the I/O priority, scanning at the normal one.")
+    tag_cache = check_tag_cache(a.tag_cache)
+    if not event.contains(db.engine, 'before_cursor_execute', report.count_query):
+        event.listen(db.engine, 'before_cursor_execute', report.count_query)
+
     # Create table.
     db.create_all()
+    upgrade_db()
 
-    # Remove deleted songs.
-    remove_old()
+    # Let the server read while the scan commits.
+    if db.engine.dialect.name == 'sqlite':
+        db.session.execute(text('PRAGMA journal_mode=WAL'))
 
-    # Count files to scan
-    filesToScan = count_folder (config.MUSIC_DIR)
+    # Fingerprints of the tracks already in the database.
+    with report.timer('load'):
+        known = get_known_tracks()
+
+    # Continue the last scan if it was interrupted, or start a new one.
+    roots = get_music_dirs()
+    resume = {}
+    last = ScanJournal.query.order_by(ScanJournal.id.desc()).first()
+    if a.resume and last != None and last.folder != None:
+        scan = last.scan
+        for entry in ScanJournal.query.filter_by(scan=scan).order_by(ScanJournal.id):
+            root = get_root(entry.folder, roots)
+            if root != None:
+                resume[root] = walk_key(entry.folder)
+        # The tracks in the committed folders are not walked again.
+        for filename in list(known):
+            root = get_root(filename, roots)
+            if root in resume and walk_key(os.path.dirname(filename)) <= resume[root]:
+                del known[filename]
+    else:
+        scan = int(time.time())
+        db.session.query(ScanJournal).delete()
+        db.session.commit()
+
+    # A full scan gives the quarantined files another chance.
+    if a.full:
+        db.session.query(Quarantine).delete()
+        db.session.commit()
+    quarantine = get_quarantine()
 
     # Import new songs
-    bar = Bar('Importing your music collection', max=filesToScan)
-    scan_folder (bar, config.MUSIC_DIR)
-    bar.finish()
+    lastId = get_last_track()
+    counter = Counter('Importing your music collection... ')
+    with report.timer('load'):
+        writer = TrackWriter(a.batch_size, scan, roots)
+    throttle = Throttle(a.max_files, a.max_mb, getattr(config, 'STREAM_HEARTBEAT', None))
+    if not throttle.enabled():
+        throttle = None
+    with report.timer('load'):
+        index = FolderIndex(known, a.prune and not a.full)
+    lanes = get_lanes(roots)
+    with contextlib.ExitStack() as stack:
+        readers = [stack.enter_context(ReaderPool(a.jobs, a.timeout, a.memory * 1024 * 1024, tag_cache, a.full)) for lane in lanes]
+        items = scan_lanes (counter, lanes, readers, known, a.full, resume, quarantine, throttle, a.order, index)
+        import_items (writer, items)
+    counter.finish()
 
-    # Commits new songs.
+    # Remove deleted songs, the ones the walk didn't find, unless moved.
+    move_tracks(known, lastId)
+    remove_old(known)
+    index.save()
+
+    db.session.add(ScanJournal(scan, None, 0, int(time.time())))
     db.session.commit()
 
+    for reason, count in sorted(report.skipped.items()):
+        print("{}: {} files skipped.".format(reason, count))
+    if a.report:
+        report.write(a.report)
+
+
+# Watch the folder and the ones below it. A folder may be gone again by
+# the time its event is read, and the watches may run out; either way the
+# others are still watched.
+def watch_folder (notifier, path):
+    mask = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_ONLYDIR
+    folders = [path]
+    while folders:
+        folder = folders.pop()
+        try:
+            notifier.add_watch(folder, mask)
+            with os.scandir(folder) as entries:
+                subfolders = [entry.path for entry in entries if entry.is_dir(follow_symlinks=False)]
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+        except OSError as e:
+            print("Can't watch {}: {}".format(folder, e))
+            continue
+        folders.extend(subfolders)
+
+def watch_changes (writer, readers, paths):
+    # Drop the paths inside other changed folders, those are walked anyway.
+    roots = collapse_paths(paths)
+
+    report.start()
+    known = get_known_tracks(roots)
+    lastId = get_last_track()
+    import_items (writer, readers.read(scan_paths(roots, known, get_quarantine())))
+    move_tracks(known, lastId)
+
+    # The writer keeps its tag ids, so orphans wait for the next update.
+    remove_old(known, orphans=False)
+
+def watch_db(a):
+    notifier = Inotify()
+    for root in get_music_dirs():
+        watch_folder (notifier, root)
+
+    # Catch up with the changes made while we were not watching.
+    update_db(a)
+    writer = TrackWriter(a.batch_size)
+    readers = ReaderPool(a.jobs, a.timeout, a.memory * 1024 * 1024, check_tag_cache(a.tag_cache))
+
+    pending = set()
+    overflow = False
+    first = last = None
+    while True:
+        timeout = None
+        if pending or overflow:
+            timeout = max(0, min(last + a.delay, first + WATCH_MAX_DELAY) - time.monotonic())
+
+        if select.select([notifier], [], [], timeout)[0]:
+            for path, mask in notifier.read_events():
+                if mask & IN_Q_OVERFLOW:
+                    overflow = True
+                    continue
+                if mask & IN_ISDIR:
+                    if mask & IN_MOVED_FROM:
+                        notifier.remove_watch_tree(path)
+                    elif mask & (IN_CREATE | IN_MOVED_TO):
+                        watch_folder (notifier, path)
+                if not overflow:
+                    pending.add(path)
+                    if len(pending) > WATCH_MAX_PENDING:
+                        overflow = True
+            if overflow:
+                pending.clear()
+
+            last = time.monotonic()
+            if first == None:
+                first = last
+            continue
+
+        # The burst settled down.
+        if overflow:
+            update_db(a)
+            writer = TrackWriter(a.batch_size)
+        else:
+            watch_changes (writer, readers, pending)
+        print("Updated {} changed paths.".format(len(pending) if not overflow else 'all'))
+
+        pending = set()
+        overflow = False
+        first = last = None
+
 
 def clean_db(a):
     db.session.query(Track).delete()
+    # Without the tracks, the folders and the journal would skip the files
+    # on the next update.
+    db.session.query(Folder).delete()
+    db.session.query(ScanJournal).delete()
     db.session.commit()
     db.session.close()
 
 
-if __name__ == '__main__':
+def get_parser():
     parser = argparse.ArgumentParser(description='Manage Music Database for PraghaServer')
-    parser.add_argument('operation', nargs='+', choices=['update', 'clean'], help='Operation')
-    args = parser.parse_args()
+    parser.add_argument('operation', nargs='+', choices=['update', 'watch', 'clean'], help='Operation')
+    parser.add_argument('--full', action='store_true', help='Read again the tags of unchanged files')
+    parser.add_argument('--resume', action='store_true', help='Continue the last interrupted update')
+    parser.add_argument('--jobs', type=int, default=1, help='Number of processes reading tags on each disk')
+    parser.add_argument('--timeout', type=float, default=30, help='Seconds a file may take to read before it is quarantined')
+    parser.add_argument('--memory', type=int, default=512, help='Megabytes a file may take to read before it is quarantined')
+    parser.add_argument('--delay', type=float, default=2.0, help='Seconds without changes before watch updates the database')
+    parser.add_argument('--tag-cache', type=str, default=getattr(config, 'TAG_CACHE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tag-cache.db')), help='Keep the tags read in this file, empty to disable')
+    parser.add_argument('--report', type=str, default=getattr(config, 'SCAN_REPORT', 'scan-report.json'), help='Write the JSON report of the update here')
+    parser.add_argument('--prune', action='store_true', default=getattr(config, 'SCAN_PRUNE', False), help='Skip the files of the folders that did not change')
+    parser.add_argument('--order', choices=['name', 'inode', 'extent'], default=getattr(config, 'SCAN_ORDER', 'name'), help='Order to read the files of a folder in')
+    parser.add_argument('--idle', action='store_true', help='Read the disk only when nobody else does')
+    parser.add_argument('--max-files', type=float, default=0, help='Most files read per second')
+    parser.add_argument('--max-mb', type=float, default=0, help='Most megabytes read per second')
+    parser.add_argument('--batch-size', type=int, default=getattr(config, 'SCAN_BATCH_SIZE', 500), help='Tracks written per commit')
+    return parser
+
+
+if __name__ == '__main__':
+    args = get_parser().parse_args()
     db.app = app
     db.init_app(app)
     with app.app_context():
         op = {
             'update': update_db,
+            'watch': watch_db,
             'clean': clean_db
         }[args.operation[0]]
-    exit(op(args))
+        exit(op(args))
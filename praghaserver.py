@@ -1,6 +1,7 @@
 from flask import Flask, request, Response
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import Column, String, Integer, ForeignKey
+from sqlalchemy import Column, String, Integer, BigInteger, ForeignKey
+from sqlalchemy import inspect, text
 import xml.etree.ElementTree as Etree
 import hashlib
 
@@ -61,13 +62,30 @@ class Track(db.Model):
     year = Column(Integer, nullable=False)
     length = Column(Integer, nullable=False)
 
+    # File fingerprint of the last scan, used to skip unchanged files.
+    size = Column(BigInteger, nullable=True, default=None)
+    mtime = Column(BigInteger, nullable=True, default=None)
+    inode = Column(BigInteger, nullable=True, default=None)
+    # Hash of the start and end of the file, to follow it when moved.
+    signature = Column(String(40), nullable=True, default=None)
+
+    # Audio properties, read with the tags.
+    samplerate = Column(Integer, nullable=True, default=None)
+    bitdepth = Column(Integer, nullable=True, default=None)
+    channels = Column(Integer, nullable=True, default=None)
+    bitrate = Column(Integer, nullable=True, default=None)
+    bitrate_mode = Column(String(8), nullable=True, default=None)
+    format = Column(String(32), nullable=True, default=None)
+    mime = Column(String(64), nullable=True, default=None)
+
     title = db.relationship('Title', backref=db.backref('Titles', lazy='dynamic'))
     artist = db.relationship('Artist', backref=db.backref('Artists', lazy='dynamic'))
     album = db.relationship('Album', backref=db.backref('Albums', lazy='dynamic'))
     genre = db.relationship('Genre', backref=db.backref('Genres', lazy='dynamic'))
     comment = db.relationship('Comment', backref=db.backref('Comments', lazy='dynamic'))
 
-    def __init__(self, filename, title_id, artist_id, album_id, genre_id, comment_id, track, year, length):
+    def __init__(self, filename, title_id, artist_id, album_id, genre_id, comment_id, track, year, length, size=None, mtime=None, inode=None, signature=None,
+                 samplerate=None, bitdepth=None, channels=None, bitrate=None, bitrate_mode=None, format=None, mime=None):
         self.filename = filename
         self.title_id = title_id
         self.artist_id = artist_id
@@ -77,6 +95,17 @@ class Track(db.Model):
         self.track = track
         self.year = year
         self.length = length
+        self.size = size
+        self.mtime = mtime
+        self.inode = inode
+        self.signature = signature
+        self.samplerate = samplerate
+        self.bitdepth = bitdepth
+        self.channels = channels
+        self.bitrate = bitrate
+        self.bitrate_mode = bitrate_mode
+        self.format = format
+        self.mime = mime
 
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -104,6 +133,65 @@ class Session(db.Model):
     def __repr__(self):
         return '<Token %r>' % self.token
 
+# One row per batch committed by the scanner, written in the same
+# transaction as the batch. folder is the last folder fully committed,
+# or None once the scan finished.
+class ScanJournal(db.Model):
+    id = Column(Integer, primary_key=True)
+    scan = Column(Integer, nullable=False)
+    folder = Column(String(1024), nullable=True)
+    tracks = Column(Integer, nullable=False)
+    time = Column(Integer, nullable=False)
+
+    def __init__(self, scan, folder, tracks, time):
+        self.scan = scan
+        self.folder = folder
+        self.tracks = tracks
+        self.time = time
+
+    def __repr__(self):
+        return '<ScanJournal %r %r>' % (self.scan, self.folder)
+
+# Files that crashed, hung or ran the tag reader out of memory, and the
+# ones rejected for their tags. The scans skip them until their
+# fingerprint changes.
+class Quarantine(db.Model):
+    id = Column(Integer, primary_key=True)
+    filename = Column(String(255), nullable=False, unique=True)
+    size = Column(BigInteger, nullable=True)
+    mtime = Column(BigInteger, nullable=True)
+    inode = Column(BigInteger, nullable=True)
+    reason = Column(String(255), nullable=False)
+    time = Column(Integer, nullable=False)
+
+    def __init__(self, filename, size, mtime, inode, reason, time):
+        self.filename = filename
+        self.size = size
+        self.mtime = mtime
+        self.inode = inode
+        self.reason = reason
+        self.time = time
+
+    def __repr__(self):
+        return '<Quarantine %r>' % (self.filename)
+
+# Folders seen by the last update, with their mtime from before they were
+# listed and the number of files in them. mtime is None when it may still
+# change within the same tick.
+class Folder(db.Model):
+    id = Column(Integer, primary_key=True)
+    path = Column(String(255), nullable=False, unique=True)
+    mtime = Column(BigInteger, nullable=True)
+    files = Column(Integer, nullable=False)
+
+    def __init__(self, path, mtime, files):
+        self.path = path
+        self.mtime = mtime
+        self.files = files
+
+    def __repr__(self):
+        return '<Folder %r>' % (self.path)
+
 # Standard routes.
 @app.route("/")
 def hello_world():
@@ -259,6 +347,16 @@ def do_songs():
             Etree.SubElement(song_root, 'year').text = str(song.year)
         if song.length > 0:
             Etree.SubElement(song_root, 'time').text = str(song.length)
+        if song.bitrate:
+            Etree.SubElement(song_root, 'bitrate').text = str(song.bitrate)
+        if song.samplerate:
+            Etree.SubElement(song_root, 'rate').text = str(song.samplerate)
+        if song.bitrate_mode:
+            Etree.SubElement(song_root, 'mode').text = song.bitrate_mode.lower()
+        if song.mime != None:
+            Etree.SubElement(song_root, 'mime').text = song.mime
+        if song.size != None:
+            Etree.SubElement(song_root, 'size').text = str(song.size)
         Etree.SubElement(song_root, 'url').text = config.PUBLIC_DOMAIN + "/play/index.php?type=song&oid="+str(song.id)+"&ssid="+str(auth)+"&uid=5&player=api&name="+str(song.id)
         n_root.append(song_root)
 
@@ -279,7 +377,11 @@ def dp_play():
     if dbSession is None:
         return session_expired()
 
-    stream = stream_audio()
+    song = Track.query.get(int(request.args.get('oid')))
+    if song == None:
+        return resource_not_found()
+
+    stream = stream_audio(song)
     if stream == None:
         return resource_not_found()
     else:
@@ -300,10 +402,26 @@ def server():
         return invalid_request()
 
 
+# Add the columns that create_all() don't append to existing tables.
+def upgrade_db():
+    inspector = inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        columns = [column['name'] for column in inspector.get_columns(table.name)]
+        for column in table.columns:
+            if column.name in columns:
+                continue
+            coltype = column.type.compile(dialect=db.engine.dialect)
+            db.session.execute(text('ALTER TABLE %s ADD COLUMN %s %s' % (table.name, column.name, coltype)))
+    db.session.commit()
+
+
 def create_app():
     db.init_app(app)
     with app.app_context():
         db.create_all()
+        upgrade_db()
         db.session.commit()
     return app
 